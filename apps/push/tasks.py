@@ -3,7 +3,7 @@ import logging
 from django.conf import settings
 from django.utils import timezone
 from django.core.cache import cache, caches
-from django.db.models import Sum, Prefetch, Q
+from django.db.models import Sum, Prefetch, Q, F
 from django.db.models.functions import Coalesce
 
 from telegram import Bot
@@ -12,7 +12,8 @@ from telegram.error import BadRequest
 from celery import shared_task
 
 from apps.telegram_adv.models import CampaignPublisher, Campaign, CampaignUser, CampaignContent, CampaignFile, \
-    TelegramChannel
+    TelegramChannel, CampaignContentViews
+from apps.telegram_adv.forecast import filling_campaign_ids
 from apps.telegram_bot.buttons import campaign_push_reply_markup
 from apps.push.models import PushText, CampaignPush, CampaignPushUser
 from apps.push.texts import SEND_CAMPAIGN_PUSH, SEND_SHOT_PUSH
@@ -55,37 +56,53 @@ def push_text_send(bot_token, telegram_user_id_list, push_id):
 @shared_task
 def check_push_campaigns():
     """
-        send push for campaigns which campaignusers channels views is less than campaign max_view
+        send push for campaigns which campaignusers channels views is less than campaign max_view,
+        campaigns which a content views counter reached max_view or are forecast to reach it in
+        VIEWS_FORECAST_PUSH_HORIZON minutes need no more publishers
     :return:
     """
-    campaigns = Campaign.objects.prefetch_related(
-        'campaignuser_set',
-        'pushes'
-    ).filter(
+    filled_campaigns = CampaignContentViews.objects.filter(
+        content__view_type=CampaignContent.TYPE_VIEW_PARTIAL,
+        views__gte=F('content__campaign__max_view')
+    ).values('content__campaign_id')
+
+    campaigns = list(Campaign.objects.filter(
         status=Campaign.STATUS_APPROVED,
         is_enable=True,
         start_datetime__lte=timezone.now(),
         end_datetime__gte=timezone.now(),
         file__isnull=False
+    ).exclude(
+        id__in=filled_campaigns
+    ).exclude(
+        id__in=filling_campaign_ids(settings.VIEWS_FORECAST_PUSH_HORIZON)
     ).annotate(
         confirmed_views=Coalesce(Sum('campaignuser__channels__view_efficiency'), 0)
-    )
-    for campaign in campaigns:
-        # no reaction pushes should count as confirmed until user reject or expire
-        campaign_push_users = CampaignPushUser.objects.filter(
-            campaign_push__campaign_id=campaign.id,
-            status=CampaignPushUser.STATUS_SENT
+    ))
+
+    # no reaction pushes should count as confirmed until user reject or expire
+    campaigns_channels = {}
+    for campaign_push_user in CampaignPushUser.objects.select_related(
+        'campaign_push',
+        'user'
+    ).filter(
+        campaign_push__campaign__in=campaigns,
+        status=CampaignPushUser.STATUS_SENT
+    ):
+        campaigns_channels.setdefault(campaign_push_user.campaign_push.campaign_id, set()).update(
+            int(channel_id) for channel_id in campaign_push_user.user.session.get('selected_channels', [])
         )
 
-        channel_list = []
-        for campaign_push_user in campaign_push_users:
-            channel_list += [*campaign_push_user.user.session.get('selected_channels', [])]
+    channels_views = dict(TelegramChannel.objects.filter(
+        id__in={channel_id for channels in campaigns_channels.values() for channel_id in channels}
+    ).values_list(
+        'id', 'view_efficiency'
+    ))
 
-        void_push_views = TelegramChannel.objects.filter(
-            id__in=channel_list
-        ).aggregate(
-            views=Coalesce(Sum('view_efficiency'), 0)
-        )['views'] or 0
+    for campaign in campaigns:
+        void_push_views = sum(
+            channels_views.get(channel_id) or 0 for channel_id in campaigns_channels.get(campaign.id, [])
+        )
         total_counted_views = campaign.confirmed_views + void_push_views
 
         if campaign.max_view > total_counted_views:
@@ -5,11 +5,13 @@ from khayyam import JalaliDatetime
 from django.shortcuts import render, Http404
 from django.utils import translation
 from django.conf import settings
-from django.db.models import Prefetch, Min, Max
+from django.db.models import Prefetch
 from django.views.generic import DetailView
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 
-from apps.telegram_adv.models import Campaign, CampaignPost, CampaignUser, CampaignContent, CampaignPostLog
+from apps.telegram_adv.models import (
+    Campaign, CampaignPost, CampaignUser, CampaignContent, CampaignPostLog, CampaignPostSeries
+)
 
 
 logger = logging.getLogger(__name__)
@@ -43,11 +45,7 @@ def campaign_report(request, campaign_code):
 
     for campaign_user in context['campaign_users']:
         for campaign_post in campaign_user.campaignpost_set.all():
-            if campaign_post.views:
-                campaign_post.last_views = campaign_post.views
-            else:
-                views = getattr(campaign_post.logs.last(), 'banner_views', 0)
-                campaign_post.last_views = views
+            campaign_post.last_views = campaign_post.views or campaign_post.latest_views or 0
 
     return render(request, 'reports/campaign_report.html', context=context)
 
@@ -73,10 +71,7 @@ class CampaignUserChartView(LoginRequiredMixin,
     permission_required = ("is_staff",)
     login_url = '/adminF077D0/'
     template_name = 'reports/statistics.html'
-    queryset = CampaignUser.objects.prefetch_related(
-        'campaignpost_set',
-        'campaignpost_set__logs'
-    ).select_related(
+    queryset = CampaignUser.objects.select_related(
         'campaign'
     )
 
@@ -92,25 +87,25 @@ class CampaignUserChartView(LoginRequiredMixin,
             'channels': campaign_user.channel_tags
         }
 
-        campaign_posts_logs_range = CampaignPostLog.objects.filter(
-            campaign_post__campaign_content__campaign=campaign_user.campaign
-        ).aggregate(
-            start_time=Min('created_time'),
-            end_time=Max('created_time'),
-        )
-        start_time = campaign_posts_logs_range['start_time']
-        end_time = campaign_posts_logs_range['end_time']
-
-        if start_time is None or end_time is None:
+        campaign_posts = list(campaign_user.campaignpost_set.select_related('campaign_content').order_by('id'))
+        posts_series = CampaignPostSeries.objects.views_series(campaign_post__in=campaign_posts)
+        # series of ended campaigns are expired after POST_SERIES_DAYS, their logs and rollups are kept
+        expired_post_ids = [post.id for post in campaign_posts if post.id not in posts_series]
+        if expired_post_ids:
+            posts_series.update(CampaignPostLog.objects.views_series(expired_post_ids))
+        if not posts_series:
             return context
 
+        # series are ordered by time
+        start_time = min(post_series[0][0] for post_series in posts_series.values())
+        end_time = max(post_series[-1][0] for post_series in posts_series.values())
         date_range = [
             timestamp.to_pydatetime()
             # TODO: dynamic freq set in settings
             for timestamp in pd.date_range(start_time, end_time, freq="30min").tolist()
         ]
         try:
-            series = CampaignUserChartView.generate_data(campaign_user, date_range)
+            series = CampaignUserChartView.generate_data(campaign_posts, posts_series, date_range)
         except Exception as e:
             logger.error(f"generate chart for campaign user: {campaign_user.id} failed, error: {e}")
             return context
@@ -145,7 +140,7 @@ class CampaignUserChartView(LoginRequiredMixin,
         }
 
     @staticmethod
-    def generate_data(campaign_user, date_range):
+    def generate_data(campaign_posts, posts_series, date_range):
         series = []
 
         # return nearest datetime in date_range
@@ -153,8 +148,11 @@ class CampaignUserChartView(LoginRequiredMixin,
             datetime = min(date_range, key=lambda x: abs(x - log_time))
             return date_range.index(datetime)
 
-        for post in campaign_user.campaignpost_set.filter(logs__isnull=False).distinct():
-            post_logs = [(log.created_time, log.banner_views) for log in post.logs.order_by('id')]
+        for post in campaign_posts:
+            post_logs = posts_series.get(post.id)
+            if not post_logs:
+                continue
+
             post_info = {
                 'name': f"{post.campaign_content.display_text}\u200e",
                 'data': ['null'] * len(date_range),
@@ -0,0 +1 @@
+default_app_config = 'apps.tel_tools.apps.TelToolsConfig'
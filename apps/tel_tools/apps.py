@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TelToolsConfig(AppConfig):
     name = 'apps.tel_tools'
+
+    def ready(self):
+        import apps.tel_tools.checks
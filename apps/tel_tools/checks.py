@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+from apps.utils.cache import is_process_local_cache
+
+
+@register()
+def governor_cache_check(app_configs, **kwargs):
+    """
+        rate governor keeps flood deadlines and token buckets of sessions in default cache, every process
+        which calls MTProto must see them or sessions are called faster than their rate
+    """
+    if not is_process_local_cache():
+        return []
+
+    message = "default cache is not shared by processes, each process paces telegram sessions by its own governor"
+    hint = 'set CACHE_BACKEND to a shared cache like memcached or redis'
+    if settings.DEVEL:
+        return [Warning(message, hint=hint, id='tel_tools.W001')]
+    return [Error(message, hint=hint, id='tel_tools.E001')]
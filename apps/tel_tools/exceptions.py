@@ -0,0 +1,4 @@
+class NoSessionAvailable(Exception):
+    def __init__(self, wait=None):
+        super().__init__(f"no telegram session is available, next call in {wait} seconds")
+        self.wait = wait
@@ -0,0 +1,98 @@
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class RateGovernor:
+    """
+        MTProto rate governor shared by every process through django cache
+
+        * flood deadlines are kept per session and per (session, rpc method), a FloodWait of one
+          method does not stop other methods of that session
+        * every session has a token bucket, TELEGRAM_SESSION_CALL_RATE tokens per second up to
+          TELEGRAM_SESSION_CALL_BURST tokens
+        * nothing sleeps here, callers ask `next_call_in` and decide to wait, use another session
+          or reschedule their task
+    """
+    LOCK_TIMEOUT = 2
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate or settings.TELEGRAM_SESSION_CALL_RATE
+        self.burst = burst or settings.TELEGRAM_SESSION_CALL_BURST
+
+    @staticmethod
+    def _flood_key(session_id, method=None):
+        if method is None:
+            return f'telegram_flood_{session_id}'
+        return f'telegram_flood_{session_id}_{method}'
+
+    @staticmethod
+    def _bucket_key(session_id):
+        return f'telegram_bucket_{session_id}'
+
+    def record_flood(self, session_id, seconds, method=None):
+        """
+            record a deadline that session (or session method if method is passed) can not be called before it
+        """
+        logger.warning(f"telegram session: {session_id} method: {method or '*'} is blocked for {seconds} seconds")
+        cache.set(self._flood_key(session_id, method), time.time() + seconds, seconds)
+
+    def flood_deadline(self, session_id, method=None):
+        keys = [self._flood_key(session_id)]
+        if method is not None:
+            keys.append(self._flood_key(session_id, method))
+        return max(cache.get_many(keys).values(), default=0)
+
+    def _refill(self, bucket, now):
+        tokens, updated = bucket or (self.burst, now)
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def tokens(self, session_id):
+        """
+        :return: available tokens of session bucket, used as remaining budget of session
+        """
+        return self._refill(cache.get(self._bucket_key(session_id)), time.time())
+
+    def next_call_in(self, session_id, method=None):
+        """
+        :return: seconds until session can call the method, 0 if it can call now
+        """
+        now = time.time()
+        wait = self.flood_deadline(session_id, method) - now
+        tokens = self.tokens(session_id)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / self.rate)
+        return max(wait, 0)
+
+    def take(self, session_id, method=None):
+        """
+            take a token of session bucket if session can call now
+
+        :return: 0 if token taken else seconds to wait
+        """
+        wait = self.next_call_in(session_id, method)
+        if wait:
+            return wait
+
+        lock_key = f'{self._bucket_key(session_id)}_lock'
+        if not cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+            # another process is taking a token of this session right now
+            return 1 / self.rate
+
+        try:
+            now = time.time()
+            tokens = self._refill(cache.get(self._bucket_key(session_id)), now)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+
+            cache.set(self._bucket_key(session_id), (tokens - 1, now), int(self.burst / self.rate) + 1)
+            return 0
+        finally:
+            cache.delete(lock_key)
+
+
+governor = RateGovernor()
@@ -0,0 +1,10 @@
+from django.core.management import BaseCommand
+
+from apps.tel_tools.worker import TelethonWorker
+
+
+class Command(BaseCommand):
+    help = 'Run long-lived telethon worker, tasks are forwarded to it when TELETHON_WORKER_ENABLED'
+
+    def handle(self, *args, **options):
+        TelethonWorker().run()
@@ -19,3 +19,23 @@ class TelegramSession(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class TelegramPeer(models.Model):
+    """
+        resolved channel of a session, access hash is valid only for the session which resolved it
+    """
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+    updated_time = models.DateTimeField(_('updated time'), auto_now=True)
+    peer_id = models.BigIntegerField(_('peer id'))
+    access_hash = models.BigIntegerField(_('access hash'))
+    username = models.CharField(_('username'), max_length=32, blank=True)
+
+    session = models.ForeignKey(TelegramSession, on_delete=models.CASCADE, related_name='peers')
+
+    class Meta:
+        db_table = 'telegram_sessions_peers'
+        unique_together = ('session', 'peer_id')
+
+    def __str__(self):
+        return f"{self.session_id} - {self.username or self.peer_id}"
@@ -0,0 +1,376 @@
+import copy
+import time
+import asyncio
+import logging
+
+from django.conf import settings
+
+from telethon import utils
+from telethon.sync import TelegramClient
+from telethon.sessions import StringSession
+from telethon.tl.types import PeerChannel
+from telethon.errors import FloodWaitError, UnauthorizedError, AuthKeyError, ChannelInvalidError
+
+from .models import TelegramSession, TelegramPeer
+from .tasks import TELETHON_PROXY
+from .exceptions import NoSessionAvailable
+from .governor import governor
+
+logger = logging.getLogger(__name__)
+
+# errors which mean the account can not be used until an admin logs in again
+AUTH_ERRORS = (UnauthorizedError, AuthKeyError)
+
+
+def method_name(request):
+    """
+        rpc method name used as governor key, e.g. GetMessagesViewsRequest
+    """
+    if request is None:
+        return None
+    return type(request).__name__
+
+
+def request_peer_id(request):
+    """
+        marked id of the channel which request is sent to
+    """
+    peer = getattr(request, 'peer', None) or getattr(request, 'channel', None)
+    try:
+        return utils.get_peer_id(peer)
+    except TypeError:
+        return None
+
+
+def channel_rows(entities):
+    """
+        channel rows of telethon memory session entities, (marked id, access hash, username, phone, name)
+    """
+    return {
+        row for row in entities
+        if row[1] and utils.resolve_id(row[0])[1] is PeerChannel
+    }
+
+
+class TelegramSessionPool:
+    """
+        spread MTProto calls over every enabled TelegramSession
+
+        * calls are paced by the shared RateGovernor, so concurrent tasks share the same budgets
+        * acquire returns the not blocked session which has the most remaining tokens
+        * sessions got FloodWait (for that method) or auth errors (for every method) are blocked
+          in governor and will not be acquired until their deadline
+        * only the sessions which are used write back their StringSession on close
+        * resolved channels are kept as TelegramPeer of session and loaded into its client, so tags and ids
+          are turned into InputPeerChannel without ResolveUsername calls. peers which got ChannelInvalid
+          are removed and resolved again on next call
+
+        usage:
+            with TelegramSessionPool(flood_sleep_threshold=0) as pool:
+                result = pool.execute(lambda client: client(request), method='GetFullChannelRequest')
+    """
+
+    def __init__(self, sessions=None, **client_options):
+        """
+        :param sessions: TelegramSessions to use, default is all enabled sessions
+        :param client_options: TelegramClient attributes like flood_sleep_threshold, request_retries
+        """
+        if sessions is None:
+            sessions = TelegramSession.objects.filter(is_enable=True).order_by('id')
+        self.sessions = list(sessions)
+        self.client_options = client_options
+        self._clients = {}
+        self._peers = {}
+        self._invalid_peers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def available(self, method=None):
+        """
+        :return: sessions which are not blocked for method, most remaining tokens first
+        """
+        now = time.time()
+        sessions = [
+            session for session in self.sessions
+            if governor.flood_deadline(session.id, method) <= now
+        ]
+        return sorted(sessions, key=lambda session: -governor.tokens(session.id))
+
+    def acquire(self, method=None):
+        sessions = self.available(method)
+        return sessions[0] if sessions else None
+
+    def take(self, session, method=None):
+        """
+        :return: 0 if session can call method now else seconds to wait
+        """
+        return governor.take(session.id, method)
+
+    def wait_time(self, method=None):
+        """
+        :return: seconds until one of sessions can call method
+        """
+        return min([governor.next_call_in(session.id, method) for session in self.sessions], default=None)
+
+    def report_error(self, session, error):
+        """
+            block session in governor due to the error type
+
+        :return: True if session is blocked and the call should move to another session
+        """
+        if isinstance(error, FloodWaitError):
+            governor.record_flood(session.id, error.seconds, method=method_name(error.request))
+            return True
+
+        if isinstance(error, AUTH_ERRORS):
+            logger.error(f"telegram session: {session} is not authorized, error: {error}")
+            governor.record_flood(session.id, settings.TELEGRAM_SESSION_AUTH_QUARANTINE)
+            return True
+
+        if isinstance(error, ChannelInvalidError):
+            self.forget_peer(session, request_peer_id(error.request))
+
+        return False
+
+    def load_peers(self, sessions):
+        """
+            load stored peers of sessions in one query
+        """
+        session_ids = [session.id for session in sessions if session.id not in self._peers]
+        for session_id in session_ids:
+            self._peers[session_id] = set()
+
+        peers = TelegramPeer.objects.filter(
+            session_id__in=session_ids
+        ).values_list(
+            'session_id', 'peer_id', 'access_hash', 'username'
+        )
+        for session_id, peer_id, access_hash, username in peers:
+            self._peers[session_id].add((peer_id, access_hash, username or None, None, None))
+
+    def forget_peer(self, session, peer_id):
+        """
+            remove an invalid peer from session client and its stored peers
+        """
+        if peer_id is None:
+            return
+
+        logger.warning(f"telegram session: {session} peer: {peer_id} is invalid and will be resolved again")
+        self._invalid_peers.setdefault(session.id, set()).add(peer_id)
+        client = self._clients.get(session.id)
+        if client is not None:
+            client.session._entities = {row for row in client.session._entities if row[0] != peer_id}
+            client._entity_cache.__dict__.pop(peer_id, None)
+
+    def _new_peers(self, session, client):
+        """
+            channels which are resolved by client and are not stored yet
+        """
+        return channel_rows(client.session._entities) - self._peers.get(session.id, set())
+
+    def _save_peers(self, session, peers):
+        invalid_peers = self._invalid_peers.pop(session.id, set())
+        if invalid_peers:
+            TelegramPeer.objects.filter(session=session, peer_id__in=invalid_peers).delete()
+
+        TelegramPeer.objects.bulk_create(
+            [
+                TelegramPeer(session=session, peer_id=peer_id, access_hash=access_hash, username=username or '')
+                for peer_id, access_hash, username, phone, name in peers
+            ],
+            ignore_conflicts=True
+        )
+        self._peers.setdefault(session.id, set()).update(peers)
+
+    def _create_client(self, session):
+        client = TelegramClient(
+            StringSession(session.session),
+            session.api_id,
+            session.api_hash,
+            proxy=TELETHON_PROXY
+        )
+        client.session.save_entities = False
+        self.load_peers([session])
+        client.session._entities.update(self._peers[session.id])
+        for option, value in self.client_options.items():
+            setattr(client, option, value)
+        return client
+
+    def client(self, session):
+        """
+            connected client of session, connects only once per pool
+        """
+        client = self._clients.get(session.id)
+        if client is None:
+            client = self._create_client(session)
+            client.connect()
+            self._clients[session.id] = client
+        return client
+
+    def execute(self, function, *args, method=None):
+        """
+            call function(client, *args) by the session which has the most remaining tokens,
+            if the session is blocked during the call try the next one.
+            waits for tokens only up to TELEGRAM_SESSION_MAX_WAIT seconds
+
+        :raise NoSessionAvailable: if no session can call method soon, has wait time to retry
+        """
+        session = self.acquire(method)
+        while session is not None:
+            wait = self.take(session, method)
+            if wait > settings.TELEGRAM_SESSION_MAX_WAIT:
+                raise NoSessionAvailable(wait)
+            elif wait:
+                time.sleep(wait)
+                continue
+
+            try:
+                return function(self.client(session), *args)
+            except Exception as e:
+                if not self.report_error(session, e):
+                    raise
+                session = self.acquire(method)
+
+        raise NoSessionAvailable(self.wait_time(method))
+
+    def _save_session(self, session, session_string, peers):
+        session.session = session_string
+        session.save(update_fields=['updated_time', 'session'])
+        self._save_peers(session, peers)
+
+    def close(self):
+        for session in self.sessions:
+            client = self._clients.pop(session.id, None)
+            if client is None:
+                continue
+
+            try:
+                self._save_session(session, client.session.save(), self._new_peers(session, client))
+            finally:
+                client.disconnect()
+
+
+class AsyncTelegramSessionPool(TelegramSessionPool):
+    """
+        TelegramSessionPool for asyncio code, clients are created and connected in the running loop
+        and many coroutines can use the same client concurrently.
+
+        sessions and their peers are loaded before and written back after the loop is finished
+        to keep database out of the loop
+
+        usage:
+            pool = AsyncTelegramSessionPool()
+            try:
+                client = await pool.client(pool.acquire())
+            finally:
+                await pool.disconnect()
+            pool.save_sessions()
+    """
+
+    def __init__(self, sessions=None, **client_options):
+        super().__init__(sessions, **client_options)
+        self._locks = {}
+        self._session_states = {}
+        self.load_peers(self.sessions)
+
+    async def client(self, session):
+        lock = self._locks.setdefault(session.id, asyncio.Lock())
+        async with lock:
+            client = self._clients.get(session.id)
+            if client is None:
+                client = self._create_client(session)
+                await client.connect()
+                self._clients[session.id] = client
+        return client
+
+    async def disconnect(self):
+        for session in self.sessions:
+            client = self._clients.pop(session.id, None)
+            if client is None:
+                continue
+
+            self._session_states[session.id] = (client.session.save(), self._new_peers(session, client))
+            await client.disconnect()
+
+    def save_sessions(self):
+        for session in self.sessions:
+            session_state = self._session_states.pop(session.id, None)
+            if session_state is not None:
+                self._save_session(session, *session_state)
+
+
+class WorkerSessionPool(AsyncTelegramSessionPool):
+    """
+        pool of the long-lived telethon worker, clients are connected once in the worker loop and stay
+        connected, with their entity cache, between jobs.
+
+        like telethon.sync methods, `client` returns a coroutine inside the running loop and a connected
+        client outside of it, so the asyncio views reader and sync tasks share the same connections.
+
+        the running worker pool is `WorkerSessionPool.current`
+    """
+    current = None
+
+    def __init__(self, loop, **client_options):
+        super().__init__(**client_options)
+        self.loop = loop
+        self._connected = {}
+
+    def client(self, session):
+        self._connected[session.id] = session
+        coroutine = super().client(session)
+        if self.loop.is_running():
+            return coroutine
+        return self.loop.run_until_complete(coroutine)
+
+    def using(self, sessions):
+        """
+            the same pool and connections limited to sessions
+        """
+        pool = copy.copy(self)
+        pool.sessions = list(sessions)
+        return pool
+
+    def close(self):
+        # jobs do not close worker connections
+        pass
+
+    def refresh_sessions(self):
+        """
+            reload enabled sessions, clients of disabled sessions are disconnected and
+            new resolved peers of connected ones are stored
+        """
+        self.sessions = list(TelegramSession.objects.filter(is_enable=True).order_by('id'))
+        self.load_peers(self.sessions)
+        enabled_ids = {session.id for session in self.sessions}
+        removed = [session for session_id, session in self._connected.items() if session_id not in enabled_ids]
+        self._disconnect(removed)
+
+        for session in self._connected.values():
+            client = self._clients.get(session.id)
+            if client is not None:
+                self._save_peers(session, self._new_peers(session, client))
+
+    def shutdown(self):
+        self._disconnect(list(self._connected.values()))
+
+    def _disconnect(self, sessions):
+        pool = self.using(sessions)
+        self.loop.run_until_complete(pool.disconnect())
+        pool.save_sessions()
+        for session in sessions:
+            self._connected.pop(session.id, None)
+
+
+def session_pool(sessions=None, **client_options):
+    """
+        TelegramSessionPool of a task, inside the telethon worker its connected pool is shared instead
+    """
+    pool = WorkerSessionPool.current
+    if pool is None:
+        return TelegramSessionPool(sessions, **client_options)
+    return pool if sessions is None else pool.using(sessions)
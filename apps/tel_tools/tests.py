@@ -0,0 +1,47 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from apps.tel_tools.governor import RateGovernor
+
+
+class RateGovernorTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.governor = RateGovernor(rate=2, burst=3)
+        self.now = 1000.0
+        patcher = mock.patch('apps.tel_tools.governor.time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        self.assertEqual([self.governor.take(1) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(self.governor.take(1), 0.5)
+
+        self.now += 0.25
+        self.assertEqual(self.governor.take(1), 0.25)
+        self.now += 0.25
+        self.assertEqual(self.governor.take(1), 0)
+
+    def test_tokens_refill_up_to_burst(self):
+        self.governor.take(1)
+        self.assertEqual(self.governor.tokens(1), 2)
+        self.now += 10
+        self.assertEqual(self.governor.tokens(1), 3)
+
+    def test_sessions_have_their_own_buckets(self):
+        for _ in range(3):
+            self.governor.take(1)
+        self.assertEqual(self.governor.take(2), 0)
+
+    def test_flood_blocks_only_its_method(self):
+        self.governor.record_flood(1, 30, method='GetHistoryRequest')
+
+        self.assertEqual(self.governor.next_call_in(1, 'GetHistoryRequest'), 30)
+        self.assertEqual(self.governor.take(1, 'GetHistoryRequest'), 30)
+        self.assertEqual(self.governor.take(1, 'GetMessagesViewsRequest'), 0)
+
+    def test_session_flood_blocks_every_method(self):
+        self.governor.record_flood(1, 30)
+        self.assertEqual(self.governor.next_call_in(1, 'GetMessagesViewsRequest'), 30)
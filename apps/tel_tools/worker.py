@@ -0,0 +1,93 @@
+import time
+import signal
+import asyncio
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from kombu import Connection
+
+from .pool import WorkerSessionPool
+
+logger = logging.getLogger(__name__)
+
+# seconds between reloading enabled sessions in worker
+SESSIONS_REFRESH_INTERVAL = 300
+
+
+def forward_to_worker(task, *args):
+    """
+        send the task call to the telethon worker through the broker when TELETHON_WORKER_ENABLED,
+        inside the worker tasks run themselves
+
+    :param task: celery task, called by its name in worker
+    :param args: json serializable task arguments
+    :return: True if the call is forwarded and task should return
+    """
+    if not settings.TELETHON_WORKER_ENABLED or WorkerSessionPool.current is not None:
+        return False
+
+    with Connection(settings.CELERY_BROKER_URL) as connection:
+        queue = connection.SimpleQueue(settings.TELETHON_WORKER_QUEUE)
+        queue.put({'task': task.name, 'args': list(args)})
+        queue.close()
+    return True
+
+
+class TelethonWorker:
+    """
+        long-lived process which keeps telethon clients of every enabled session connected in one
+        event loop and runs forwarded tasks one by one with them, so a job costs its RPCs only
+        instead of connect, handshake and session save
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.stopped = False
+
+    def stop(self, *args):
+        logger.info("telethon worker is stopping")
+        self.stopped = True
+
+    def run_job(self, job):
+        try:
+            task = import_string(job['task'])
+            started = time.time()
+            task(*job['args'])
+            logger.info(f"telethon worker job: {job['task']} done in {time.time() - started:.2f} seconds")
+        except Exception as e:
+            logger.exception(f"telethon worker job: {job} failed, error: {e}")
+        finally:
+            close_old_connections()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        pool = WorkerSessionPool(self.loop, flood_sleep_threshold=0, request_retries=2)
+        WorkerSessionPool.current = pool
+        refreshed = time.time()
+        try:
+            with Connection(settings.CELERY_BROKER_URL) as connection:
+                queue = connection.SimpleQueue(settings.TELETHON_WORKER_QUEUE)
+                while not self.stopped:
+                    if time.time() - refreshed > SESSIONS_REFRESH_INTERVAL:
+                        pool.refresh_sessions()
+                        close_old_connections()
+                        refreshed = time.time()
+
+                    try:
+                        message = queue.get(block=True, timeout=1)
+                    except queue.Empty:
+                        continue
+
+                    self.run_job(message.payload)
+                    message.ack()
+                queue.close()
+        finally:
+            WorkerSessionPool.current = None
+            pool.shutdown()
+            self.loop.close()
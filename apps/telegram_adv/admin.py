@@ -18,6 +18,7 @@ from django.core.paginator import Paginator
 
 from apps.utils.admin import ReadOnlyAdmin, ReadOnlyTabularInline, CampaignFilter
 from apps.telegram_bot.tasks import read_campaign_posts_views, get_files_id
+from apps.telegram_bot.views_reader import forget_read_errors
 from .models import (
     TelegramChannel,
     ShortLink,
@@ -33,7 +34,8 @@ from .models import (
     InlineKeyboard,
     CampaignFile,
     CampaignLink,
-    CampaignPostLog
+    CampaignPostLog,
+    CampaignPostPoll
 )
 
 from .forms import ImportCampaignUserForm, ImportCampaignContentFilesForm, BankAccountExchangeForm
@@ -147,7 +149,7 @@ class IsConsumedListFilter(admin.SimpleListFilter):
 @admin.register(ShortLink)
 class ShortLinkAdmin(ReadOnlyAdmin):
     list_display = [
-        'link', 'id', 'campaign_link', 'created_time', 'reference_id', 'campaign_post'
+        'link', 'id', 'campaign_link', 'created_time', 'reference_id', 'utm_content', 'claimed_time', 'campaign_post'
     ]
     search_fields = ['link', 'reference_id']
     list_filter = (
@@ -637,6 +639,26 @@ def update_campaign_posts_view(modeladmin, request, queryset):
 update_campaign_posts_view.short_description = _("Update Views for selected posts")
 
 
+def clear_read_errors(modeladmin, request, queryset):
+    """
+        read views of flagged posts again, posts of open campaigns return to the poll queue.
+        cached errors of their channels are forgotten too, otherwise the next read flags them again
+    """
+    posts = list(queryset.exclude(read_error='').values_list(
+        'id', 'campaign_content__mother_channel__chat_id', 'campaign_content__mother_channel__tag'
+    ))
+    post_ids = [post_id for post_id, chat_id, tag in posts]
+    forget_read_errors({chat_id or tag for post_id, chat_id, tag in posts if chat_id or tag})
+    CampaignPost.objects.filter(id__in=post_ids).update(read_error='', read_error_time=None)
+    CampaignPostPoll.objects.bulk_create(
+        [CampaignPostPoll(campaign_post_id=post_id, next_poll_time=timezone.now()) for post_id in post_ids],
+        ignore_conflicts=True
+    )
+
+
+clear_read_errors.short_description = _("Clear read errors of selected posts")
+
+
 def approve_screenshots(modeladmin, request, queryset):
     q = queryset.exclude(
         screen_shot__in=['', 'no_shot']
@@ -669,19 +691,20 @@ class CampaignPostAdmin(ReadOnlyAdmin):
     list_display = [
         'campaign_content', 'id', 'user', 'view_type',
         'has_tariff', 'has_tracker', 'is_enable',
-        'is_approved', 'screen_preview', 'message_id', 'views'
+        'is_approved', 'screen_preview', 'message_id', 'views', 'read_error'
     ]
     readonly_fields = [
         'campaign_content', 'campaign_user', 'campaign_file',
-        'approve_time', 'screen_time'
+        'approve_time', 'screen_time', 'read_error', 'read_error_time'
     ]
     list_select_related = ['campaign_content', 'campaign_user', 'campaign_file']
     search_fields = ['=campaign_user__user__username']
-    actions = [approve_screenshots, update_campaign_posts_view]
+    actions = [approve_screenshots, update_campaign_posts_view, clear_read_errors]
     list_filter = (
         HasTariffPostListFilter,
         HasScreenShotListFilter,
         HasShortLinkListFilter,
+        'read_error',
     )
 
     list_per_page = 50
@@ -700,9 +723,8 @@ class CampaignPostAdmin(ReadOnlyAdmin):
         return obj.campaign_content.view_type
 
     def last_log_view(self, obj):
-        last_log = obj.logs.last()
-        if last_log:
-            return last_log.banner_views
+        if obj.latest_views is not None:
+            return obj.latest_views
         return '-'
 
     def user(self, obj):
@@ -1,6 +1,4 @@
 from django.conf import settings
-from django.db.models import Sum, Case, When, Max, F, Avg
-from django.db.models.functions import Coalesce
 from rest_framework import status
 
 from apps.push.models import CampaignPush, CampaignPushUser
@@ -17,41 +15,28 @@ def get_campaign_publisher_views(campaign_id):
     :return:
     """
     report = []
-    for content in CampaignContent.objects.prefetch_related(
-            'campaignpost_set__logs'
-    ).filter(
+    for content in CampaignContent.objects.filter(
         campaign_id=campaign_id,
         # view_type=CampaignContent.TYPE_VIEW_PARTIAL
     ).order_by(
         'id'
     ):
-        # qs = content.campaignpost_set.filter(is_enable=True)
-        # views = qs.annotate(
-        #     post_views=Case(
-        #         When(
-        #             views__isnull=True, then=Max('logs__banner_views')
-        #         ), default=F('views')
-        #     )
-        # ).aggregate(
-        #     views=Coalesce(Sum('post_views'), 0)
-        # )['views']
-        qs = CampaignPostLog.objects.filter(campaign_post__is_enable=True, campaign_post__campaign_content=content)
-
-        views = qs.values('campaign_post').annotate(post_views=Max('banner_views'))
+        # raw logs and their rollups of enabled posts
+        post_filters = dict(campaign_post__is_enable=True, campaign_post__campaign_content=content)
+        max_views = CampaignPostLog.objects.max_views(**post_filters)
 
         if content.view_type == CampaignContent.TYPE_VIEW_TOTAL:
-            post_views = views.aggregate(views=Coalesce(Avg('post_views'), 0))['views']
+            post_views = sum(max_views.values()) / len(max_views) if max_views else 0
         else:
-            post_views = views.aggregate(views=Coalesce(Sum('post_views'), 0))['views']
+            post_views = sum(max_views.values())
 
         hourly_views = {}
-        hourly = qs.values('created_time__hour', 'campaign_post').annotate(total_view=Max('banner_views'))
-        for _h in hourly:
-            hourly_views.setdefault(_h['created_time__hour'], 0)
+        for (hour, _p), total_view in CampaignPostLog.objects.hourly_max_views(**post_filters).items():
+            hourly_views.setdefault(hour, 0)
             if content.view_type == CampaignContent.TYPE_VIEW_TOTAL:
-                hourly_views[_h['created_time__hour']] = max(_h['total_view'], hourly_views[_h['created_time__hour']])
+                hourly_views[hour] = max(total_view, hourly_views[hour])
             else:
-                hourly_views[_h['created_time__hour']] += _h['total_view']
+                hourly_views[hour] += total_view
 
         report.append(
             {
@@ -59,7 +44,7 @@ def get_campaign_publisher_views(campaign_id):
                 'views': int(post_views),
                 'hourly': hourly_views,
                 'detail': CampaignUserSerializer(
-                    CampaignUser.objects.filter(id__in=qs.values_list('campaign_post__campaign_user__id', flat=True)), many=True).data
+                    CampaignUser.objects.filter(campaignpost__id__in=list(max_views)).distinct(), many=True).data
             }
         )
 
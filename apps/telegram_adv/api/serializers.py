@@ -270,10 +270,7 @@ class CampaignPostSerializer(serializers.ModelSerializer):
         )
 
     def get_views(self, obj):
-        if not obj.views:
-            return getattr(obj.logs.last(), 'banner_views', 0)
-
-        return obj.views
+        return obj.views or obj.latest_views or 0
 
 
 class CampaignUserSerializer(serializers.ModelSerializer):
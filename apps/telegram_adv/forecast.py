@@ -0,0 +1,169 @@
+"""
+    forecast of the time which campaigns reach their max_view
+
+    recent views curve of every partial content of open campaigns is built from CampaignPostLog on a time
+    grid (logs are carried forward), a line is fitted to all curves at once and its slope gives the time
+    which the content counter reaches campaign max_view. a campaign fills at its earliest content.
+    forecasts are kept on campaigns so every process reads the same ones
+"""
+import logging
+
+import numpy as np
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Campaign, CampaignContent, CampaignPost, CampaignPostLog
+
+logger = logging.getLogger(__name__)
+
+# seconds a forecast is used, a few runs of its task
+FORECAST_TIMEOUT = 900
+
+
+def carried_views(post_indexes, seconds, views, posts_count, grid):
+    """
+        views of posts on grid times, a post has its latest log before each time and its first log
+        before that. posts without logs are zero
+
+    :param post_indexes: row of post of every log
+    :param seconds: time of logs, seconds from grid origin
+    :param views: views of logs
+    :param posts_count:
+    :param grid: times in seconds from grid origin
+    :return: array of posts_count x len(grid)
+    """
+    if not len(views):
+        return np.zeros((posts_count, len(grid)))
+
+    span = max(seconds.max(), grid.max()) + 1
+    order = np.lexsort((seconds, post_indexes))
+    keys = post_indexes[order] * span + seconds[order]
+    sorted_posts = post_indexes[order]
+    sorted_views = views[order]
+    rows = np.arange(posts_count)
+
+    # latest log of post at or before every grid time
+    found = np.searchsorted(keys, (rows[:, None] * span + grid[None, :]).ravel(), side='right') - 1
+    found = found.reshape(posts_count, len(grid))
+    valid = (found >= 0) & (sorted_posts[found.clip(0)] == rows[:, None])
+
+    # first log of post, kept before it is logged in grid
+    first = np.searchsorted(keys, rows * span).clip(max=len(keys) - 1)
+    first_views = np.where(sorted_posts[first] == rows, sorted_views[first], 0)
+
+    return np.where(valid, sorted_views[found.clip(0)], first_views[:, None])
+
+
+def fill_seconds(grid, curves, remaining):
+    """
+        least squares slope of every curve and the seconds until it grows `remaining` views
+
+    :param grid: times of curves
+    :param curves: array of contents x len(grid)
+    :param remaining: views to max_view of every content
+    :return: seconds of every content, inf if its curve does not grow
+    """
+    centered_grid = grid - grid.mean()
+    slopes = (curves - curves.mean(axis=1, keepdims=True)) @ centered_grid / (centered_grid @ centered_grid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        seconds = np.where(slopes > 0, remaining / slopes, np.inf)
+    return np.where(remaining <= 0, 0, seconds)
+
+
+def forecast_fill_times(now=None):
+    """
+        :return: {campaign_id: forecast time of reaching max_view} of open campaigns which are growing
+    """
+    now = now or timezone.now()
+    contents = list(CampaignContent.objects.filter(
+        view_type=CampaignContent.TYPE_VIEW_PARTIAL,
+        campaign__status=Campaign.STATUS_APPROVED,
+        campaign__is_enable=True,
+        campaign__start_datetime__lte=now,
+        campaign__end_datetime__gte=now,
+    ).values_list(
+        'id', 'campaign_id', 'campaign__max_view', 'views_counter__views'
+    ))
+    if not contents:
+        return {}
+
+    content_indexes = {content[0]: i for i, content in enumerate(contents)}
+    posts = list(CampaignPost.objects.filter(
+        campaign_content_id__in=list(content_indexes),
+        is_enable=True,
+    ).values_list('id', 'campaign_content_id'))
+    if not posts:
+        return {}
+    post_indexes = {post_id: i for i, (post_id, _c) in enumerate(posts)}
+
+    window = settings.VIEWS_FORECAST_WINDOW * 3600
+    origin = now - timezone.timedelta(seconds=window, minutes=settings.VIEWS_LOG_HEARTBEAT)
+    logs = np.array(list(CampaignPostLog.objects.filter(
+        campaign_post_id__in=list(post_indexes),
+        created_time__gte=origin,
+    ).values_list(
+        'campaign_post_id', 'created_time', 'banner_views'
+    ).iterator()), dtype=object).reshape(-1, 3)
+
+    grid = np.linspace((now - origin).total_seconds() - window, (now - origin).total_seconds(),
+                       settings.VIEWS_FORECAST_POINTS)
+    views = carried_views(
+        np.array([post_indexes[post_id] for post_id in logs[:, 0]], dtype=np.int64),
+        np.array([(time - origin).total_seconds() for time in logs[:, 1]], dtype=np.float64),
+        logs[:, 2].astype(np.float64),
+        len(posts),
+        grid
+    )
+
+    curves = np.zeros((len(contents), len(grid)))
+    np.add.at(curves, np.array([content_indexes[content_id] for _p, content_id in posts]), views)
+
+    current_views = np.array([
+        counter_views if counter_views is not None else curves[i, -1]
+        for i, (_id, _c, _m, counter_views) in enumerate(contents)
+    ], dtype=np.float64)
+    max_views = np.array([max_view for _id, _c, max_view, _v in contents], dtype=np.float64)
+    seconds = fill_seconds(grid, curves, max_views - current_views)
+
+    fill_times = {}
+    for (content_id, campaign_id, _m, _v), content_seconds in zip(contents, seconds):
+        if np.isfinite(content_seconds):
+            fill_time = now + timezone.timedelta(seconds=float(content_seconds))
+            fill_times[campaign_id] = min(fill_time, fill_times.get(campaign_id, fill_time))
+    return fill_times
+
+
+def save_fill_times(fill_times, now=None):
+    """
+        keep fill times on their campaigns, forecasts of the other campaigns are cleared
+
+    :param fill_times: {campaign_id: forecast time of reaching max_view}
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        Campaign.objects.filter(
+            fill_forecast_time__isnull=False
+        ).exclude(
+            id__in=list(fill_times)
+        ).update(
+            fill_forecast_time=None,
+            forecast_time=None
+        )
+        Campaign.objects.bulk_update([
+            Campaign(id=campaign_id, fill_forecast_time=fill_time, forecast_time=now)
+            for campaign_id, fill_time in fill_times.items()
+        ], ['fill_forecast_time', 'forecast_time'])
+
+
+def filling_campaign_ids(minutes, now=None):
+    """
+        :return: ids of campaigns which are forecast in last FORECAST_TIMEOUT seconds to reach their max_view
+                 in `minutes`
+    """
+    now = now or timezone.now()
+    return set(Campaign.objects.filter(
+        forecast_time__gte=now - timezone.timedelta(seconds=FORECAST_TIMEOUT),
+        fill_forecast_time__lte=now + timezone.timedelta(minutes=minutes),
+    ).values_list('id', flat=True))
@@ -0,0 +1,36 @@
+from django.core.management import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from apps.telegram_adv.models import CampaignPost, CampaignPostLog
+
+
+class Command(BaseCommand):
+    help = 'Fill latest views of campaign posts from their last CampaignPostLog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk',
+                            dest='chunk',
+                            type=int,
+                            default=5000,
+                            help='posts updated in each statement')
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        last_logs = CampaignPostLog.objects.filter(
+            campaign_post_id=OuterRef('id')
+        ).order_by('-id')
+
+        post_ids = list(CampaignPost.objects.filter(
+            latest_views__isnull=True,
+            logs__isnull=False
+        ).distinct().order_by('id').values_list('id', flat=True))
+
+        updated = 0
+        for i in range(0, len(post_ids), chunk):
+            updated += CampaignPost.objects.filter(
+                id__in=post_ids[i:i + chunk]
+            ).update(
+                latest_views=Subquery(last_logs.values('banner_views')[:1]),
+                latest_views_at=Subquery(last_logs.values('created_time')[:1])
+            )
+            self.stdout.write(f"{updated} of {len(post_ids)} posts updated")
@@ -0,0 +1,38 @@
+from django.core.management import BaseCommand
+from django.db.models import Q
+
+from apps.telegram_adv.models import CampaignPost, CampaignPostLog, CampaignPostSeries
+
+
+class Command(BaseCommand):
+    help = 'Pack CampaignPostLog history and its rollups into CampaignPostSeries of posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk',
+                            dest='chunk',
+                            type=int,
+                            default=500,
+                            help='posts packed in each transaction')
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        post_ids = list(CampaignPost.objects.filter(
+            Q(logs__isnull=False) | Q(log_rollups__isnull=False)
+        ).distinct().order_by('id').values_list('id', flat=True))
+
+        readings = 0
+        for i in range(0, len(post_ids), chunk):
+            chunk_ids = post_ids[i:i + chunk]
+            packed_series = CampaignPostSeries.objects.views_series(campaign_post_id__in=chunk_ids)
+            history = CampaignPostLog.objects.views_series(chunk_ids)
+
+            # only readings before the first packed point of post, later ones are packed by views readers
+            chunk_readings = [
+                (campaign_post_id, time, views)
+                for campaign_post_id, post_history in history.items()
+                for time, views in post_history
+                if campaign_post_id not in packed_series or time < packed_series[campaign_post_id][0][0]
+            ]
+            CampaignPostSeries.objects.add_readings(chunk_readings)
+            readings += len(chunk_readings)
+            self.stdout.write(f"{min(i + chunk, len(post_ids))} of {len(post_ids)} posts, {readings} readings packed")
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from apps.telegram_adv import partitions
+from apps.telegram_adv.models import CampaignPostLog, ShortLinkLog
+from apps.telegram_adv.tasks import maintain_log_partitions
+
+
+class Command(BaseCommand):
+    help = 'Monthly partitioning of CampaignPostLog and ShortLinkLog tables on PostgreSQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert',
+                            dest='convert',
+                            action='store_true',
+                            help='turn log tables into partitioned tables, current rows are kept in legacy partition')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('log partitioning needs PostgreSQL')
+
+        for model in (CampaignPostLog, ShortLinkLog):
+            table = model._meta.db_table
+            if partitions.is_partitioned(table):
+                self.stdout.write(f"{table} is partitioned")
+            elif options['convert']:
+                partitions.convert(model)
+                self.stdout.write(f"{table} is converted")
+            else:
+                raise CommandError(f"{table} is not partitioned, run with --convert")
+
+        maintain_log_partitions()
+        for model in (CampaignPostLog, ShortLinkLog):
+            table = model._meta.db_table
+            for name, lower, upper in partitions.partitions(table):
+                self.stdout.write(f"{name}: {lower or '-'} to {upper or '-'}")
+
+        if not settings.LOGS_PARTITIONED:
+            self.stdout.write(self.style.WARNING('set LOGS_PARTITIONED to roll up and drop partitions in tasks'))
@@ -1,6 +1,8 @@
 import re
+import sys
+from array import array
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models.fields.files import ImageFieldFile
 from django.urls import reverse
 from django.conf import settings
@@ -11,8 +13,8 @@ from django.utils.translation import ugettext_lazy as _
 from django.utils.safestring import mark_safe
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db.models import Case, When, F, IntegerField, Max, Sum
-from django.db.models.functions import Coalesce
+from django.db.models import Case, When, F, Q, IntegerField, Max, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncHour
 from django.contrib.postgres.fields import JSONField
 
 from khayyam import JalaliDatetime
@@ -133,6 +135,9 @@ class Campaign(models.Model):
     is_enable = models.BooleanField(_("is enable"), default=False)
     start_datetime = models.DateTimeField(_('start datetime'))
     end_datetime = models.DateTimeField(_('end datetime'))
+    # forecast time of reaching max_view and time of the forecast, see `forecast_campaigns_fill`
+    fill_forecast_time = models.DateTimeField(_('fill forecast time'), null=True, editable=False)
+    forecast_time = models.DateTimeField(_('forecast time'), null=True, editable=False)
 
     publishers = models.ManyToManyField(TelegramChannel, through="CampaignPublisher")
     receiver_agents = models.ManyToManyField('TelegramAgent', verbose_name='receiver agent', blank=True)
@@ -171,7 +176,7 @@ class Campaign(models.Model):
         max Campaign total contents views
         * views is same for all CampaignUser then max of views if enough
             1 - their views field if is not null
-            2 - else last CampaignPostLog of that CampaignPost views
+            2 - else latest logged views of that CampaignPost
 
         :return: list of Content name and it's views
         """
@@ -183,7 +188,7 @@ class Campaign(models.Model):
                 Case(
                     When(campaignpost__views__isnull=False, then=F("campaignpost__views")),
                     output_field=IntegerField(),
-                    default=F("campaignpost__logs__banner_views"),
+                    default=F("campaignpost__latest_views"),
                 ), output_field=IntegerField()
             )
         ).values("id", "display_text", "views"))
@@ -193,53 +198,37 @@ class Campaign(models.Model):
         Sum Campaign partial contents views
             condition CampaignPost views:
                 1 - their views field if is not null
-                2 - else last CampaignPostLog of that CampaignPost views
+                2 - else latest logged views of that CampaignPost
             then:
                 Sum views together
 
         :return: list of Content name and it's views
         """
-
-        campaign_contents_info = {
-            x['id']: dict(text=x['display_text'], views=x['views'])
-            for x in self.contents.filter(
-                view_type=CampaignContent.TYPE_VIEW_PARTIAL,
-                campaignpost__is_enable=True,
-                campaignpost__views__isnull=False,
-            ).annotate(
-                views=Sum("campaignpost__views")
-            ).values("id", "display_text", "views")
-        }
-
-        for cp in CampaignPost.objects.select_related('campaign_content').filter(
-                campaign_content__campaign=self,
-                campaign_content__view_type=CampaignContent.TYPE_VIEW_PARTIAL,
-                is_enable=True,
-                views__isnull=True,
-        ):
-            views = getattr(cp.logs.last(), 'banner_views', 0)
-            cc = cp.campaign_content
-            if cc.id in campaign_contents_info:
-                campaign_contents_info[cc.id]['views'] += views
-            else:
-                campaign_contents_info[cc.id] = dict(id=cc.id, display_text=cc.display_text, views=views)
-
-        return list(campaign_contents_info.values())
+        return list(self.contents.filter(
+            view_type=CampaignContent.TYPE_VIEW_PARTIAL,
+            campaignpost__is_enable=True,
+        ).annotate(
+            views=Sum(Coalesce("campaignpost__views", "campaignpost__latest_views", 0))
+        ).values("id", "display_text", "views"))
 
     def shortlink_views(self):
-        links = list(
-            self.contents.filter(
-                links__isnull=False
-            ).prefetch_related(
-                "links__short_links__logs"
-            ).values(
-                'id', 'display_text'
-            ).annotate(
-                ip_count=Sum('links__short_links__logs__ip_count'),
-                hit_count=Sum('links__short_links__logs__hit_count')
-            )
-        )
-        return links
+        """
+            clicks of contents which have links, sum of the latest counts of their shortlinks
+        """
+        short_links = ShortLink.objects.filter(
+            campaign_link__campaign_content__campaign=self
+        ).values_list('campaign_link__campaign_content_id', 'ip_count', 'hit_count')
+
+        links = {
+            content['id']: dict(content, ip_count=None, hit_count=None)
+            for content in self.contents.filter(links__isnull=False).values('id', 'display_text').distinct()
+        }
+        for content_id, ip_count, hit_count in short_links:
+            if ip_count is None:
+                continue
+            links[content_id]['ip_count'] = (links[content_id]['ip_count'] or 0) + ip_count
+            links[content_id]['hit_count'] = (links[content_id]['hit_count'] or 0) + hit_count
+        return list(links.values())
 
     @property
     def report_link(self):
@@ -315,6 +304,105 @@ class CampaignContent(models.Model):
             raise ValidationError(_('one of content or is_sticker should fill'), code='invalid')
 
 
+class CampaignContentViewsManager(models.Manager):
+    def add_readings(self, readings):
+        """
+            apply new readings of posts to their content counters, partial contents add the views growth
+            of posts and total contents keep the max views of posts
+
+        :param readings: iterable of (content, old views, new views) of an enabled post
+        """
+        deltas = {}
+        maxima = {}
+        for content, old_views, new_views in readings:
+            if content.view_type == CampaignContent.TYPE_VIEW_TOTAL:
+                maxima[content.id] = max(new_views, maxima.get(content.id, 0))
+            elif new_views != old_views:
+                deltas[content.id] = deltas.get(content.id, 0) + new_views - old_views
+        if not deltas and not maxima:
+            return
+
+        self.bulk_create(
+            [CampaignContentViews(content_id=content_id) for content_id in {**deltas, **maxima}],
+            ignore_conflicts=True
+        )
+        now = timezone.now()
+        for content_id, delta in deltas.items():
+            self.filter(content_id=content_id).update(views=F('views') + delta, updated_time=now)
+        for content_id, views in maxima.items():
+            self.filter(content_id=content_id).update(views=Greatest('views', views), updated_time=now)
+
+    def reconcile(self, contents):
+        """
+            set counters of contents to their full aggregate over enabled posts. counters are locked before
+            the aggregate is taken, so readings which readers add meanwhile wait and are applied on top of it
+
+        :param contents: CampaignContent queryset
+        :return: number of counters which were drifted
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            counters = {
+                counter.content_id: counter
+                for counter in self.select_for_update().filter(content__in=contents)
+            }
+            aggregates = {}
+            for view_type, aggregate in (
+                    (CampaignContent.TYPE_VIEW_PARTIAL, Sum), (CampaignContent.TYPE_VIEW_TOTAL, Max)
+            ):
+                aggregates.update(contents.filter(
+                    view_type=view_type,
+                ).annotate(
+                    content_views=aggregate(Case(
+                        When(
+                            campaignpost__is_enable=True,
+                            then=Coalesce("campaignpost__views", "campaignpost__latest_views", 0)
+                        ),
+                        default=0,
+                        output_field=IntegerField()
+                    ))
+                ).values_list('id', 'content_views'))
+
+            drifted = []
+            for content_id, views in aggregates.items():
+                counter = counters.get(content_id) or CampaignContentViews(content_id=content_id)
+                if counter.views != (views or 0):
+                    drifted.append(content_id)
+                counter.views = views or 0
+                counter.reconciled_time = now
+                counter.updated_time = now
+                counters[content_id] = counter
+
+            self.bulk_update(
+                [counter for counter in counters.values() if counter.pk],
+                ['views', 'reconciled_time', 'updated_time'],
+                batch_size=1000
+            )
+            self.bulk_create([counter for counter in counters.values() if not counter.pk], ignore_conflicts=True)
+        return len(drifted)
+
+
+class CampaignContentViews(models.Model):
+    """
+        running views of a content, sum of its posts views for partial and max of them for total contents.
+        updated by views readers and reconciled with the full aggregate by `reconcile_contents_views` task
+    """
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+    updated_time = models.DateTimeField(_('updated time'), auto_now=True)
+    views = models.PositiveIntegerField(_('views'), default=0)
+    reconciled_time = models.DateTimeField(_('reconciled time'), null=True, blank=True)
+
+    content = models.OneToOneField(CampaignContent, on_delete=models.CASCADE, related_name='views_counter')
+
+    objects = CampaignContentViewsManager()
+
+    class Meta:
+        db_table = "campaigns_contents_views"
+
+    def __str__(self):
+        return f"{self.content_id} - {self.views}"
+
+
 class CampaignLink(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     updated_time = models.DateTimeField(_('last update time'), auto_now=True)
@@ -333,15 +421,50 @@ class CampaignLink(models.Model):
         return bool(self.inline)
 
 
+class ShortLinkManager(models.Manager):
+    def pool(self):
+        """
+            pre-generated shortlinks which are not claimed by a campaign user yet
+        """
+        return self.filter(claimed_time__isnull=True).exclude(utm_content='')
+
+    def claim(self, campaign_link, campaign_user_id):
+        """
+            take a pooled shortlink of campaign_link for campaign user, rows locked by other renders are skipped
+
+        :return: claimed ShortLink or None if the pool is empty
+        """
+        with transaction.atomic():
+            short_link = self.pool().select_for_update(skip_locked=True).filter(
+                campaign_link=campaign_link
+            ).order_by('id').first()
+            if short_link is not None:
+                short_link.campaign_user_id = campaign_user_id
+                short_link.claimed_time = timezone.now()
+                short_link.save(update_fields=['updated_time', 'campaign_user', 'claimed_time'])
+        return short_link
+
+
 class ShortLink(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     updated_time = models.DateTimeField(_('last update time'), auto_now=True)
     link = models.CharField(_('short link'), max_length=60)
     reference_id = models.PositiveIntegerField(_('reference id'), blank=True)
+    # utm_content of link destination, a token of a pooled link which is bound to campaign_user on claim
+    utm_content = models.CharField(_('utm content'), max_length=64, blank=True)
+    claimed_time = models.DateTimeField(_('claimed time'), null=True, blank=True)
+    # counts of the latest log, kept here since old ShortLinkLog partitions are dropped. None until stats are read
+    hit_count = models.PositiveIntegerField(_('hit count'), null=True, editable=False)
+    ip_count = models.PositiveIntegerField(_('ip count'), null=True, editable=False)
 
     campaign_link = models.ForeignKey(CampaignLink, on_delete=models.CASCADE, related_name="short_links")
+    campaign_user = models.ForeignKey(
+        "CampaignUser", on_delete=models.SET_NULL, related_name="short_links", null=True, blank=True
+    )
     campaign_post = models.ForeignKey("CampaignPost", on_delete=models.CASCADE, related_name="links", null=True)
 
+    objects = ShortLinkManager()
+
     class Meta:
         db_table = 'telegram_short_links'
 
@@ -509,6 +632,16 @@ class CampaignUser(models.Model):
 
 
 class CampaignPost(models.Model):
+    READ_ERROR_MESSAGE_MISSING = 'message_missing'
+    READ_ERROR_CHANNEL_PRIVATE = 'channel_private'
+    READ_ERROR_CHANNEL_INVALID = 'channel_invalid'
+
+    READ_ERRORS = (
+        (READ_ERROR_MESSAGE_MISSING, _('message missing')),
+        (READ_ERROR_CHANNEL_PRIVATE, _('channel private')),
+        (READ_ERROR_CHANNEL_INVALID, _('channel invalid')),
+    )
+
     def shot_directory_path(self, filename):
         ext = filename.split('.')[-1]
         return f'shot_{self.id}.{ext}'
@@ -520,6 +653,11 @@ class CampaignPost(models.Model):
     screen_shot = models.ImageField(_('screen shot'), upload_to=shot_directory_path, blank=True)
     screen_time = models.DateTimeField(_('screen shot time'), null=True, editable=False)
     approve_time = models.DateTimeField(_('approve time'), null=True, editable=False)
+    read_failures = models.PositiveSmallIntegerField(_('read failures'), default=0, editable=False)
+    latest_views = models.PositiveIntegerField(_('latest views'), null=True, editable=False)
+    latest_views_at = models.DateTimeField(_('latest views time'), null=True, editable=False)
+    read_error = models.CharField(_('read error'), max_length=15, choices=READ_ERRORS, blank=True, editable=False)
+    read_error_time = models.DateTimeField(_('read error time'), null=True, editable=False)
 
     campaign_content = models.ForeignKey(CampaignContent, on_delete=models.CASCADE)
     campaign_file = models.ForeignKey(CampaignFile, on_delete=models.CASCADE, related_name="posts", null=True,
@@ -573,14 +711,279 @@ class CampaignPost(models.Model):
             )
 
 
+class CampaignPostLogManager(models.Manager):
+    """
+        readers of post views history, raw logs and their rollups are read together
+    """
+
+    def views_series(self, campaign_post_ids):
+        """
+        :return: {campaign_post_id: [(time, views), ...]} ordered by time, rollup buckets give their last reading
+        """
+        series = {}
+        rollups = CampaignPostLogRollup.objects.filter(
+            campaign_post_id__in=campaign_post_ids
+        ).order_by(
+            'last_time'
+        ).values_list(
+            'campaign_post_id', 'last_time', 'last_views'
+        )
+        logs = self.filter(
+            campaign_post_id__in=campaign_post_ids
+        ).order_by(
+            'id'
+        ).values_list(
+            'campaign_post_id', 'created_time', 'banner_views'
+        )
+        for queryset in (rollups, logs):
+            for campaign_post_id, time, views in queryset:
+                series.setdefault(campaign_post_id, []).append((time, views))
+        return series
+
+    def max_views(self, **filters):
+        """
+        :return: {campaign_post_id: max views} of posts which match filters
+        """
+        max_views = {}
+        logs = self.filter(**filters).values('campaign_post_id').annotate(views=Max('banner_views'))
+        rollups = CampaignPostLogRollup.objects.filter(**filters).values('campaign_post_id').annotate(
+            views=Max('max_views')
+        )
+        for queryset in (rollups, logs):
+            for row in queryset:
+                max_views[row['campaign_post_id']] = max(row['views'], max_views.get(row['campaign_post_id'], 0))
+        return max_views
+
+    def hourly_max_views(self, **filters):
+        """
+            logs are written on views change, so a post reading is carried forward over the hours
+            which post has no log. daily rollups have no hour and are not included
+
+        :return: {(hour of day, campaign_post_id): max views} of posts which match filters
+        """
+        buckets = {}
+        logs = self.filter(**filters).annotate(hour_time=TruncHour('created_time')).values(
+            'campaign_post_id', 'hour_time'
+        ).annotate(
+            views=Max('banner_views')
+        ).values_list('campaign_post_id', 'hour_time', 'views')
+        rollups = CampaignPostLogRollup.objects.filter(
+            period=CampaignPostLogRollup.PERIOD_HOUR, **filters
+        ).values_list('campaign_post_id', 'start_time', 'max_views')
+        for queryset in (rollups, logs):
+            for campaign_post_id, hour_time, views in queryset:
+                post_buckets = buckets.setdefault(campaign_post_id, {})
+                post_buckets[hour_time] = max(views, post_buckets.get(hour_time, 0))
+
+        hourly = {}
+        for campaign_post_id, post_buckets in buckets.items():
+            hour_time, last_hour_time = min(post_buckets), max(post_buckets)
+            views = 0
+            while hour_time <= last_hour_time:
+                views = post_buckets.get(hour_time, views)
+                key = (hour_time.hour, campaign_post_id)
+                hourly[key] = max(views, hourly.get(key, 0))
+                hour_time += timezone.timedelta(hours=1)
+        return hourly
+
+
 class CampaignPostLog(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     banner_views = models.PositiveIntegerField(_('banner views'))
 
     campaign_post = models.ForeignKey(CampaignPost, on_delete=models.CASCADE, related_name='logs')
 
+    objects = CampaignPostLogManager()
+
     class Meta:
         db_table = "campaigns_posts_logs"
 
     def __str__(self):
         return f"{self.campaign_post_id}"
+
+
+class CampaignPostLogRollup(models.Model):
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+
+    PERIODS = (
+        (PERIOD_HOUR, _('hour')),
+        (PERIOD_DAY, _('day')),
+    )
+
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+    period = models.CharField(_('period'), max_length=4, choices=PERIODS)
+    start_time = models.DateTimeField(_('start time'))
+    min_views = models.PositiveIntegerField(_('min views'))
+    max_views = models.PositiveIntegerField(_('max views'))
+    last_views = models.PositiveIntegerField(_('last views'))
+    last_time = models.DateTimeField(_('last time'))
+    samples = models.PositiveIntegerField(_('samples'))
+
+    campaign_post = models.ForeignKey(CampaignPost, on_delete=models.CASCADE, related_name='log_rollups')
+
+    class Meta:
+        db_table = "campaigns_posts_logs_rollups"
+        unique_together = ('campaign_post', 'period', 'start_time')
+
+    def __str__(self):
+        return f"{self.campaign_post_id} - {self.period} {self.start_time}"
+
+    def merge(self, min_views, max_views, last_views, last_time, samples):
+        self.min_views = min(self.min_views, min_views)
+        self.max_views = max(self.max_views, max_views)
+        if last_time >= self.last_time:
+            self.last_views = last_views
+            self.last_time = last_time
+        self.samples += samples
+
+
+class CampaignPostSeriesManager(models.Manager):
+    def add_readings(self, readings):
+        """
+            merge readings into day rows of their posts, points of a day stay ordered by time
+            and a reading of an existing time replaces it
+
+        :param readings: iterable of (campaign_post_id, time, views)
+        """
+        points = {}
+        for campaign_post_id, time, views in readings:
+            points.setdefault((campaign_post_id, time.date()), {})[CampaignPostSeries.offset(time)] = views
+        if not points:
+            return
+
+        with transaction.atomic():
+            updated_series = []
+            for series in self.select_for_update().filter(
+                    campaign_post_id__in={campaign_post_id for campaign_post_id, _ in points},
+                    day__in={day for _, day in points},
+            ):
+                new_points = points.pop((series.campaign_post_id, series.day), None)
+                if new_points is not None:
+                    series.points = CampaignPostSeries.pack({**dict(series.unpack(series.points)), **new_points})
+                    updated_series.append(series)
+
+            self.bulk_update(updated_series, ['points'], batch_size=1000)
+            self.bulk_create(
+                [
+                    CampaignPostSeries(
+                        campaign_post_id=campaign_post_id,
+                        day=day,
+                        points=CampaignPostSeries.pack(day_points)
+                    )
+                    for (campaign_post_id, day), day_points in points.items()
+                ],
+                batch_size=1000
+            )
+
+    def views_series(self, **filters):
+        """
+            history of posts which match filters in one query
+
+        :return: {campaign_post_id: [(time, views), ...]} ordered by time
+        """
+        series = {}
+        rows = self.filter(**filters).order_by('campaign_post_id', 'day').values_list(
+            'campaign_post_id', 'day', 'points'
+        )
+        for campaign_post_id, day, points in rows:
+            day_start = timezone.datetime.combine(day, timezone.datetime.min.time())
+            series.setdefault(campaign_post_id, []).extend(
+                (day_start + timezone.timedelta(seconds=offset), views)
+                for offset, views in CampaignPostSeries.unpack(points)
+            )
+        return series
+
+
+class CampaignPostSeries(models.Model):
+    """
+        views history of a post in a day packed as unsigned 32 bit little endian pairs of
+        (seconds from start of day, views)
+    """
+    day = models.DateField(_('day'))
+    points = models.BinaryField(_('points'), default=b'')
+
+    campaign_post = models.ForeignKey(CampaignPost, on_delete=models.CASCADE, related_name='series')
+
+    objects = CampaignPostSeriesManager()
+
+    class Meta:
+        db_table = "campaigns_posts_series"
+        unique_together = ('campaign_post', 'day')
+
+    def __str__(self):
+        return f"{self.campaign_post_id} - {self.day}"
+
+    @staticmethod
+    def offset(time):
+        return time.hour * 3600 + time.minute * 60 + time.second
+
+    @staticmethod
+    def pack(points):
+        """
+        :param points: {offset: views}
+        :return: bytes of points ordered by offset
+        """
+        values = array('I')
+        for offset in sorted(points):
+            values.extend((offset, points[offset]))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tobytes()
+
+    @staticmethod
+    def unpack(data):
+        """
+        :return: list of (offset, views)
+        """
+        values = array('I')
+        values.frombytes(bytes(data))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return list(zip(values[::2], values[1::2]))
+
+
+class CampaignPostPollManager(models.Manager):
+    def due(self, now=None):
+        """
+            polls which their time is reached and are not leased by a live worker
+        """
+        now = now or timezone.now()
+        return self.filter(
+            Q(lease_expire_time__isnull=True) | Q(lease_expire_time__lt=now),
+            next_poll_time__lte=now,
+        )
+
+    def claim(self, lease_owner, size, lease_seconds):
+        """
+            lease the most overdue polls to lease_owner, rows locked by other workers are skipped
+
+        :return: list of claimed CampaignPostPoll
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            polls = list(
+                self.due(now).select_for_update(skip_locked=True).order_by('next_poll_time')[:size]
+            )
+            for poll in polls:
+                poll.lease_owner = lease_owner
+                poll.lease_expire_time = now + timezone.timedelta(seconds=lease_seconds)
+            self.bulk_update(polls, ['lease_owner', 'lease_expire_time'])
+        return polls
+
+
+class CampaignPostPoll(models.Model):
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+    next_poll_time = models.DateTimeField(_('next poll time'), db_index=True)
+    lease_owner = models.CharField(_('lease owner'), max_length=64, blank=True)
+    lease_expire_time = models.DateTimeField(_('lease expire time'), null=True, blank=True)
+
+    campaign_post = models.OneToOneField(CampaignPost, on_delete=models.CASCADE, related_name='poll')
+
+    objects = CampaignPostPollManager()
+
+    class Meta:
+        db_table = "campaigns_posts_polls"
+
+    def __str__(self):
+        return f"{self.campaign_post_id}"
@@ -0,0 +1,147 @@
+"""
+    monthly range partitioning of log tables by created_time on PostgreSQL (11+)
+
+    * a converted table keeps its old rows in `<table>_legacy` partition which covers every time before
+      its first monthly partition
+    * partitions are named `<table>_pYYYYMM` and cover [first of month, first of next month)
+    * expired partitions are detached and dropped, retention costs no DELETE
+"""
+import re
+import logging
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PARTITION_BOUND_RE = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+def month_start(time, months=0):
+    month = time.month - 1 + months
+    return time.replace(
+        year=time.year + month // 12, month=month % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def parse_bound(bound):
+    """
+    :return: naive datetime of a partition bound, None for MINVALUE and MAXVALUE
+    """
+    bound = bound.strip("'")
+    if bound in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return timezone.datetime.fromisoformat(bound)
+
+
+def is_partitioned(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(table):
+    """
+    :return: list of (partition name, lower bound, upper bound) ordered by lower bound, None bound is unlimited
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s",
+            [table]
+        )
+        rows = cursor.fetchall()
+
+    result = []
+    for name, bound in rows:
+        match = PARTITION_BOUND_RE.search(bound)
+        if match is None:
+            continue
+        result.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+    return sorted(result, key=lambda partition: partition[1] or timezone.datetime.min)
+
+
+def convert(model):
+    """
+        turn model table into a partitioned table, current rows stay in `<table>_legacy` which is attached
+        for times before the next month. foreign keys and their indexes are defined on the partitioned table,
+        matching indexes of legacy table are attached by postgres instead of being built again.
+        the id sequence is moved to the partitioned table, so dropping legacy partition keeps it
+    """
+    table = model._meta.db_table
+    legacy_table = f'{table}_legacy'
+    foreign_keys = [field for field in model._meta.concrete_fields if field.is_relation]
+    first_month = month_start(timezone.now(), 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT max(created_time) FROM "{table}"')
+        last_time = cursor.fetchone()[0]
+        if last_time is not None and last_time >= first_month:
+            first_month = month_start(last_time, 1)
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+        sequence = cursor.fetchone()[0]
+
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy_table}"')
+        cursor.execute(
+            f'CREATE TABLE "{table}" (LIKE "{legacy_table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (created_time)'
+        )
+        cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, created_time)')
+        cursor.execute(
+            f'ALTER TABLE "{table}" ATTACH PARTITION "{legacy_table}" FOR VALUES FROM (MINVALUE) TO (%s)',
+            [first_month]
+        )
+        # legacy indexes of foreign keys are attached, not built
+        for field in foreign_keys:
+            cursor.execute(f'CREATE INDEX "{table}_{field.column}_idx" ON "{table}" ("{field.column}")')
+            cursor.execute(
+                f'ALTER TABLE "{table}" ADD FOREIGN KEY ("{field.column}") '
+                f'REFERENCES "{field.related_model._meta.db_table}" (id) DEFERRABLE INITIALLY DEFERRED'
+            )
+        if sequence:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{table}".id')
+    logger.info(f"table: {table} is partitioned, old rows are in {legacy_table} until {first_month}")
+
+
+def create_partitions(table, months_ahead):
+    """
+        create monthly partitions until `months_ahead` months after the current month
+    """
+    last_upper = max([upper for _n, _l, upper in partitions(table) if upper is not None], default=None)
+    start = last_upper or month_start(timezone.now())
+    created = []
+    with connection.cursor() as cursor:
+        while start < month_start(timezone.now(), months_ahead + 1):
+            end = month_start(start, 1)
+            name = f'{table}_p{start:%Y%m}'
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" FOR VALUES FROM (%s) TO (%s)',
+                [start, end]
+            )
+            created.append(name)
+            start = end
+    return created
+
+
+def drop_partition(table, name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+        cursor.execute(f'DROP TABLE "{name}"')
+
+
+def drop_partitions(table, before):
+    """
+        detach and drop partitions which all their times are before `before`
+
+    :return: dropped partition names
+    """
+    dropped = []
+    for name, lower, upper in partitions(table):
+        if upper is None or upper > before:
+            continue
+        drop_partition(table, name)
+        dropped.append(name)
+    return dropped
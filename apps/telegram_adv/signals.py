@@ -1,8 +1,9 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from apps.telegram_bot.tasks import upload_file
-from .models import CampaignUser, CampaignFile, TelegramChannel
+from .models import CampaignUser, CampaignFile, TelegramChannel, CampaignPost, CampaignPostPoll
 from .tasks import send_paid_push, update_publisher_channel
 
 
@@ -27,3 +28,12 @@ def paid_push_notification(sender, instance, created, **kwargs):
 def create_channel(sender, instance, created, **kwargs):
     if created:
         update_publisher_channel.delay()
+
+
+@receiver(post_save, sender=CampaignPost)
+def enqueue_campaign_post_poll(sender, instance, created, **kwargs):
+    if created and instance.message_id:
+        CampaignPostPoll.objects.get_or_create(
+            campaign_post=instance,
+            defaults=dict(next_poll_time=timezone.now())
+        )
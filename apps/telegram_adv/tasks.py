@@ -3,15 +3,34 @@ import logging
 import requests
 from celery import shared_task
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from telegram import Bot
 
 from django.db.models import Case, When, F, Sum, IntegerField, Q
 
 from .texts import PAID_PUSH
-from .models import CampaignUser, Campaign, BankAccount, TelegramChannel, CampaignContent
+from .models import (
+    CampaignUser,
+    Campaign,
+    BankAccount,
+    TelegramChannel,
+    CampaignContent,
+    CampaignContentViews,
+    CampaignPostLog,
+    CampaignPostLogRollup,
+    CampaignPostPoll,
+    CampaignPostSeries,
+    ShortLinkLog
+)
+from . import forecast, partitions
 
 logger = logging.getLogger(__name__)
 
+# rows rolled up and deleted in each transaction
+ROLLUP_CHUNK_SIZE = 50000
+ROLLUP_FIELDS = ['min_views', 'max_views', 'last_views', 'last_time', 'samples']
+
 
 @shared_task
 def check_to_calculate_campaign_user(campaign_users_ids):
@@ -92,19 +111,56 @@ def disable_campaign_by_max_view():
     """
         disable campaigns which even one of the contents views achieved max_view
         and don't read banner views until campaign end datetime.
+        contents views are read from their running counters
+    """
+    campaign_ids = CampaignContentViews.objects.filter(
+        content__view_type=CampaignContent.TYPE_VIEW_PARTIAL,
+        content__campaign__status=Campaign.STATUS_APPROVED,
+        content__campaign__is_enable=True,
+        views__gte=F('content__campaign__max_view')
+    ).values_list('content__campaign_id', flat=True)
+
+    Campaign.objects.filter(
+        id__in=list(campaign_ids)
+    ).update(
+        is_enable=False,
+        updated_time=timezone.now()
+    )
+
+
+@shared_task
+def reconcile_contents_views():
+    """
+        set contents views counters of approved campaigns to their full aggregate,
+        counters drift by views which are not written by views readers like admin edits and disabled posts
     """
-    campaigns = Campaign.objects.filter(
-        status=Campaign.STATUS_APPROVED,
-        is_enable=True
-    ).only(
-        'max_view'
+    drifted = CampaignContentViews.objects.reconcile(
+        CampaignContent.objects.filter(campaign__status=Campaign.STATUS_APPROVED)
     )
+    if drifted:
+        logger.warning(f"{drifted} contents views counters were drifted and reconciled")
 
-    for campaign in campaigns:
-        contents_info = campaign.partial_contents_views()
-        if any([cc['views'] >= campaign.max_view for cc in contents_info]):
-            campaign.is_enable = False
-            campaign.save(update_fields=['updated_time', 'is_enable'])
+
+@shared_task
+def forecast_campaigns_fill():
+    """
+        forecast when open campaigns reach their max_view, polls of campaigns which fill in
+        VIEWS_FORECAST_POLL_HORIZON minutes are brought forward to the min poll interval
+    """
+    now = timezone.now()
+    fill_times = forecast.forecast_fill_times(now)
+    forecast.save_fill_times(fill_times, now)
+
+    filling_ids = forecast.filling_campaign_ids(settings.VIEWS_FORECAST_POLL_HORIZON, now)
+    if filling_ids:
+        next_poll_time = now + timezone.timedelta(minutes=settings.VIEWS_POLL_MIN_INTERVAL)
+        CampaignPostPoll.objects.filter(
+            campaign_post__campaign_content__campaign_id__in=filling_ids,
+            next_poll_time__gt=next_poll_time
+        ).update(
+            next_poll_time=next_poll_time
+        )
+        logger.info(f"campaigns: {sorted(filling_ids)} are forecast to reach their max view soon")
 
 
 @shared_task
@@ -167,3 +223,182 @@ def update_publisher_channel():
     except Exception as e:
         logger.error(f'calling update publisher api failed due to {e}')
         return
+
+
+def rollup_start_time(time, period):
+    if period == CampaignPostLogRollup.PERIOD_HOUR:
+        return time.replace(minute=0, second=0, microsecond=0)
+    return time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def merge_rollups(rows, period):
+    """
+        merge readings into rollup buckets of period, existing buckets are updated
+
+    :param rows: iterable of (campaign_post_id, time, min_views, max_views, last_views, last_time, samples)
+    :param period: CampaignPostLogRollup period
+    """
+    buckets = {}
+    for campaign_post_id, time, min_views, max_views, last_views, last_time, samples in rows:
+        start_time = rollup_start_time(time, period)
+        bucket = buckets.get((campaign_post_id, start_time))
+        if bucket is None:
+            buckets[(campaign_post_id, start_time)] = CampaignPostLogRollup(
+                campaign_post_id=campaign_post_id,
+                period=period,
+                start_time=start_time,
+                min_views=min_views,
+                max_views=max_views,
+                last_views=last_views,
+                last_time=last_time,
+                samples=samples,
+            )
+        else:
+            bucket.merge(min_views, max_views, last_views, last_time, samples)
+
+    updated_rollups = []
+    for rollup in CampaignPostLogRollup.objects.filter(
+            period=period,
+            campaign_post_id__in={campaign_post_id for campaign_post_id, _ in buckets},
+            start_time__in={start_time for _, start_time in buckets},
+    ):
+        bucket = buckets.pop((rollup.campaign_post_id, rollup.start_time), None)
+        if bucket is not None:
+            rollup.merge(bucket.min_views, bucket.max_views, bucket.last_views, bucket.last_time, bucket.samples)
+            updated_rollups.append(rollup)
+
+    CampaignPostLogRollup.objects.bulk_update(updated_rollups, ROLLUP_FIELDS, batch_size=1000)
+    CampaignPostLogRollup.objects.bulk_create(buckets.values(), batch_size=1000)
+
+
+def rollup_raw_logs(before, after=None, delete=True):
+    """
+        roll up CampaignPostLog rows created before `before` (and from `after`) into hourly buckets
+
+    :param delete: delete rolled up rows, partitions are dropped by caller instead
+    """
+    logs = CampaignPostLog.objects.filter(created_time__lt=before)
+    if after is not None:
+        logs = logs.filter(created_time__gte=after)
+
+    rolled_up = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(logs.filter(
+                id__gt=last_id
+            ).order_by(
+                'id'
+            ).values_list(
+                'id', 'campaign_post_id', 'created_time', 'banner_views'
+            )[:ROLLUP_CHUNK_SIZE])
+            if not chunk:
+                return rolled_up
+
+            merge_rollups(
+                (
+                    (campaign_post_id, created_time, views, views, views, created_time, 1)
+                    for _, campaign_post_id, created_time, views in chunk
+                ),
+                CampaignPostLogRollup.PERIOD_HOUR
+            )
+            last_id = chunk[-1][0]
+            if delete:
+                logs.filter(id__lte=last_id).delete()
+            rolled_up += len(chunk)
+
+
+def rollup_log_partitions(before):
+    """
+        roll up every CampaignPostLog partition which ends before `before` and drop it.
+        a monthly partition is rolled up and dropped in one transaction, the legacy partition of a
+        converted table has years of rows and is rolled up and emptied chunk by chunk before it is dropped
+    """
+    table = CampaignPostLog._meta.db_table
+    rolled_up = 0
+    for name, lower, upper in partitions.partitions(table):
+        if upper is None or upper > before:
+            continue
+
+        if lower is None:
+            rolled_up += rollup_raw_logs(upper)
+            partitions.drop_partition(table, name)
+        else:
+            with transaction.atomic():
+                rolled_up += rollup_raw_logs(upper, after=lower, delete=False)
+                partitions.drop_partition(table, name)
+        logger.info(f"post logs partition: {name} is rolled up and dropped")
+    return rolled_up
+
+
+def maintain_log_partitions():
+    """
+        create next monthly partitions of log tables and drop expired ShortLinkLog partitions
+    """
+    for model in (CampaignPostLog, ShortLinkLog):
+        partitions.create_partitions(model._meta.db_table, settings.LOGS_PARTITIONS_AHEAD)
+
+    if settings.SHORT_LINK_LOGS_MONTHS:
+        dropped = partitions.drop_partitions(
+            ShortLinkLog._meta.db_table,
+            partitions.month_start(timezone.now(), -settings.SHORT_LINK_LOGS_MONTHS)
+        )
+        if dropped:
+            logger.info(f"short link logs partitions: {dropped} are dropped")
+
+
+def rollup_hourly_logs(before):
+    """
+        roll up hourly buckets which started before `before` into daily buckets and delete them
+    """
+    rolled_up = 0
+    while True:
+        with transaction.atomic():
+            hourly_rollups = list(CampaignPostLogRollup.objects.filter(
+                period=CampaignPostLogRollup.PERIOD_HOUR,
+                start_time__lt=before
+            ).order_by(
+                'id'
+            ).values_list(
+                'id', 'campaign_post_id', 'start_time', *ROLLUP_FIELDS
+            )[:ROLLUP_CHUNK_SIZE])
+            if not hourly_rollups:
+                return rolled_up
+
+            merge_rollups((row[1:] for row in hourly_rollups), CampaignPostLogRollup.PERIOD_DAY)
+            CampaignPostLogRollup.objects.filter(id__in=[row[0] for row in hourly_rollups]).delete()
+            rolled_up += len(hourly_rollups)
+
+
+@shared_task
+def rollup_campaign_post_logs():
+    """
+        compact views history, raw logs older than POST_LOGS_RAW_DAYS become hourly min/max/last buckets,
+        hourly buckets older than POST_LOGS_HOURLY_DAYS become daily ones and daily buckets are deleted
+        after POST_LOGS_DAILY_DAYS if it is set. series of posts are deleted POST_SERIES_DAYS after their campaign end
+        if it is set.
+
+        with LOGS_PARTITIONED raw logs are rolled up per monthly partition, partitions which end before
+        POST_LOGS_RAW_DAYS are dropped instead of deleting their rows
+    """
+    now = timezone.now()
+    if settings.LOGS_PARTITIONED:
+        maintain_log_partitions()
+        raw_logs = rollup_log_partitions(now - timezone.timedelta(days=settings.POST_LOGS_RAW_DAYS))
+    else:
+        raw_logs = rollup_raw_logs(now - timezone.timedelta(days=settings.POST_LOGS_RAW_DAYS))
+    hourly_rollups = rollup_hourly_logs(now - timezone.timedelta(days=settings.POST_LOGS_HOURLY_DAYS))
+    logger.info(f"rolled up {raw_logs} post logs and {hourly_rollups} hourly rollups")
+
+    if settings.POST_LOGS_DAILY_DAYS:
+        CampaignPostLogRollup.objects.filter(
+            period=CampaignPostLogRollup.PERIOD_DAY,
+            start_time__lt=now - timezone.timedelta(days=settings.POST_LOGS_DAILY_DAYS)
+        ).delete()
+
+    if settings.POST_SERIES_DAYS:
+        CampaignPostSeries.objects.filter(
+            campaign_post__campaign_content__campaign__end_datetime__lt=now - timezone.timedelta(
+                days=settings.POST_SERIES_DAYS
+            )
+        ).delete()
@@ -1,12 +1,20 @@
+from unittest import mock
+
+import numpy as np
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 from rest_framework.authtoken.models import Token
 
 from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 
-from apps.telegram_adv.models import TelegramAgent
+from apps.telegram_adv.admin import clear_read_errors
+from apps.telegram_adv.forecast import carried_views, fill_seconds
+from apps.telegram_adv.models import CampaignContent, CampaignPost, ReceiverChannel, TelegramAgent
+from apps.telegram_bot import views_reader
 
 
 class CampaignAPITestCase(APITestCase):
@@ -184,3 +192,55 @@ class CampaignAPITestCase(APITestCase):
         TelegramAgent.objects.create(bot_token=bot_token, specific_mark="test")
         response = self.client.get(reverse('campaign-test', args=[1]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ForecastTestCase(SimpleTestCase):
+    def test_carried_views(self):
+        views = carried_views(
+            post_indexes=np.array([0, 0, 1]),
+            seconds=np.array([10., 30., 25.]),
+            views=np.array([100., 200., 50.]),
+            posts_count=3,
+            grid=np.array([0., 20., 40.]),
+        )
+        # first log is kept before it, latest log after it and posts without logs are zero
+        np.testing.assert_array_equal(views, [[100, 100, 200], [50, 50, 50], [0, 0, 0]])
+
+    def test_carried_views_without_logs(self):
+        views = carried_views(np.array([]), np.array([]), np.array([]), 2, np.array([0., 10.]))
+        np.testing.assert_array_equal(views, np.zeros((2, 2)))
+
+    def test_fill_seconds(self):
+        seconds = fill_seconds(
+            np.array([0., 3600., 7200.]),
+            np.array([[0., 100., 200.], [50., 50., 50.], [0., 100., 200.]]),
+            np.array([450., 100., -10.]),
+        )
+        # 100 views an hour needs 4.5 hours, flat curve never fills and a full content fills now
+        np.testing.assert_allclose(seconds, [4.5 * 3600, np.inf, 0])
+
+
+class ClearReadErrorsTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.channel = ReceiverChannel(chat_id=-1001, tag='@channel')
+        self.campaign_post = CampaignPost(
+            id=1, message_id=10, campaign_content=CampaignContent(mother_channel=self.channel)
+        )
+
+    @mock.patch('apps.telegram_adv.admin.CampaignPostPoll')
+    @mock.patch('apps.telegram_adv.admin.CampaignPost')
+    def test_cleared_post_is_read_again(self, campaign_post_model, campaign_post_poll_model):
+        key = views_reader.read_error_cache_key(self.channel.get_id_or_tag)
+        cache.set(key, CampaignPost.READ_ERROR_CHANNEL_PRIVATE)
+        cache.set(f'{key}_strike', 1)
+        queryset = mock.MagicMock()
+        queryset.exclude.return_value.values_list.return_value = [(1, self.channel.chat_id, self.channel.tag)]
+
+        clear_read_errors(None, None, queryset)
+
+        campaign_post_model.objects.filter.assert_called_once_with(id__in=[1])
+        self.assertEqual(cache.get_many([key, f'{key}_strike']), {})
+        with mock.patch.object(views_reader, 'read_channels_views', return_value=[([self.campaign_post], 50)]):
+            results = views_reader.read_posts_views([self.campaign_post])
+        self.assertEqual(results, [([self.campaign_post], 50)])
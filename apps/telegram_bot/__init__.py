@@ -0,0 +1 @@
+default_app_config = 'apps.telegram_bot.apps.TelegrambotConfig'
@@ -0,0 +1,183 @@
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .exceptions import ShortLinkError
+
+logger = logging.getLogger(__name__)
+
+# responses which are worth another try, other client errors are final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def required(body, *keys):
+    """
+    :return: body if it is a json object which has keys
+    :raise ShortLinkError: if it is not
+    """
+    if not isinstance(body, dict) or any(key not in body for key in keys):
+        raise ShortLinkError(f'admd response has not {", ".join(keys)}, body: {str(body)[:200]}')
+    return body
+
+
+class AdmdClient:
+    """
+        client of ADMD shortlink api
+
+        * one keep-alive connection pool (requests.Session) per process, calls time out after ADMD_TIMEOUT
+        * failed calls are retried ADMD_RETRIES times with jittered exponential backoff
+        * a circuit breaker shared by every process through django cache, ADMD_CIRCUIT_FAILURES failed calls
+          in ADMD_CIRCUIT_RESET seconds open the circuit and calls fail fast until it is reset
+        * `map` runs calls concurrently in a thread pool of ADMD_WORKERS threads
+        * stats can be read by conditional requests (ETag) or by batches if ADMD supports them
+
+        failures and responses which are not json or miss their fields are raised as ShortLinkError
+    """
+    def __init__(self, circuit_prefix='admd_circuit'):
+        """
+        :param circuit_prefix: cache key prefix of circuit breaker state, clients with different prefixes
+            do not share their circuit
+        """
+        self.circuit_prefix = circuit_prefix
+        self._session = None
+
+    @property
+    def failures_key(self):
+        return f'{self.circuit_prefix}_failures'
+
+    @property
+    def open_key(self):
+        return f'{self.circuit_prefix}_open'
+
+    @property
+    def session(self):
+        if self._session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.ADMD_WORKERS)
+            self._session = requests.Session()
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+            self._session.headers['Authorization'] = settings.ADMD_API_TOKEN
+        return self._session
+
+    def _record_failure(self):
+        cache.add(self.failures_key, 0, settings.ADMD_CIRCUIT_RESET)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # counter expired between add and incr
+            return
+        if failures >= settings.ADMD_CIRCUIT_FAILURES and cache.add(self.open_key, 1, settings.ADMD_CIRCUIT_RESET):
+            logger.error(f"admd circuit is open for {settings.ADMD_CIRCUIT_RESET} seconds after {failures} failures")
+
+    @staticmethod
+    def backoff(attempt):
+        """
+            full jitter, a random wait up to ADMD_BACKOFF * 2 ** attempt capped by ADMD_BACKOFF_MAX
+        """
+        return random.uniform(0, min(settings.ADMD_BACKOFF_MAX, settings.ADMD_BACKOFF * 2 ** attempt))
+
+    def send(self, method, path='', url=None, **kwargs):
+        """
+        :param url: full url of the call, default is `path` of ADMD_API_URL
+        :return: successful (or not modified) response
+        :raise ShortLinkError: if the circuit is open or all tries failed
+        """
+        if cache.get(self.open_key):
+            raise ShortLinkError('admd circuit is open')
+
+        url = url or f'{settings.ADMD_API_URL}{path}'
+        error = None
+        for attempt in range(settings.ADMD_RETRIES + 1):
+            if attempt:
+                time.sleep(self.backoff(attempt - 1))
+            try:
+                response = self.session.request(
+                    method, url, timeout=(settings.ADMD_CONNECT_TIMEOUT, settings.ADMD_TIMEOUT), **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                continue
+
+            if response.status_code in RETRY_STATUSES:
+                error = f'status: {response.status_code}, body: {response.text[:200]}'
+                continue
+            if not response.ok:
+                raise ShortLinkError(f'{method} {url} failed, status: {response.status_code}, body: {response.text}')
+
+            cache.delete(self.failures_key)
+            return response
+
+        self._record_failure()
+        raise ShortLinkError(f'{method} {url} failed after {settings.ADMD_RETRIES + 1} tries, error: {error}')
+
+    @staticmethod
+    def json(response):
+        """
+        :return: json body of response
+        :raise ShortLinkError: if body is not json
+        """
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ShortLinkError(f'{response.url} returned invalid json, error: {e}, body: {response.text[:200]}')
+
+    def request(self, method, path='', **kwargs):
+        """
+        :return: json body of response
+        """
+        return self.json(self.send(method, path, **kwargs))
+
+    def create_shortlink(self, payload):
+        """
+        :return: created shortlink, which has its "id" and "short_url"
+        """
+        return required(self.request('POST', json=payload), 'id', 'short_url')
+
+    def shortlink_stats(self, reference_id, etag=None):
+        """
+            stats of a shortlink, a conditional request if etag of its previous response is given
+
+        :return: (stats or None if they are not modified since etag, etag of response)
+        """
+        response = self.send('GET', f'{reference_id}', headers={'If-None-Match': etag} if etag else {})
+        if response.status_code == 304:
+            return None, etag
+        return required(self.json(response), 'hit_count', 'ip_count'), response.headers.get('ETag')
+
+    def shortlinks_stats(self, reference_ids):
+        """
+            stats of many shortlinks by one call of ADMD_STATS_BATCH_URL, which gets {"ids": [reference ids]}
+            and returns a list of stats with their "id"
+
+        :return: {reference id: stats}
+        """
+        response = self.send('POST', url=settings.ADMD_STATS_BATCH_URL, json={'ids': list(reference_ids)})
+        body = self.json(response)
+        if not isinstance(body, list):
+            raise ShortLinkError(f'admd batch stats is not a list, body: {str(body)[:200]}')
+        return {stats['id']: stats for stats in (required(stats, 'id', 'hit_count', 'ip_count') for stats in body)}
+
+    def map(self, function, items):
+        """
+            call function for items concurrently
+
+        :return: list of (item, result or ShortLinkError) in order of items
+        """
+        def call(item):
+            try:
+                return item, function(item)
+            except ShortLinkError as e:
+                return item, e
+
+        with ThreadPoolExecutor(max_workers=settings.ADMD_WORKERS) as executor:
+            return list(executor.map(call, items))
+
+
+admd = AdmdClient()
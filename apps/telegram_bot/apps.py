@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TelegrambotConfig(AppConfig):
     name = 'apps.telegram_bot'
+
+    def ready(self):
+        import apps.telegram_bot.checks
@@ -0,0 +1,19 @@
+from django.core.checks import Error, register
+
+from apps.utils.cache import is_process_local_cache
+from . import clicks
+
+
+@register()
+def shortlink_backend_check(app_configs, **kwargs):
+    """
+        local shortlinks are counted by web processes and written by celery workers, their counters
+        must be in a cache which is shared by processes
+    """
+    if clicks.is_local_backend() and is_process_local_cache():
+        return [Error(
+            f"SHORTLINK_BACKEND is {clicks.LOCAL_BACKEND} but default cache is not shared by processes",
+            hint='set CACHE_BACKEND to a shared cache like memcached or redis',
+            id='telegram_bot.E001',
+        )]
+    return []
@@ -0,0 +1,166 @@
+"""
+    in-project shortlinks, the alternative of ADMD when SHORTLINK_BACKEND is "local"
+
+    * a shortlink is `SHORTLINK_BASE_URL` + UrlEncoder code of its id, creating it is only a row insert
+    * `short-link` view redirects codes to their CampaignLink with UTM params and counts clicks in cache
+      counters, which must be a cache shared by every web process
+    * `log_short_links` reads the counters, adds them to the latest counts of links like ADMD stats and releases
+      them once the logs are committed
+"""
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from apps.utils.cache import is_process_local_cache
+from apps.utils.url_encoder import UrlEncoder
+from apps.telegram_adv.models import ShortLink
+from .exceptions import ShortLinkError
+
+logger = logging.getLogger(__name__)
+
+LOCAL_BACKEND = 'local'
+# seconds a resolved target url is cached
+TARGET_CACHE_TIMEOUT = 3600
+UTM_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term')
+
+url_encoder = UrlEncoder()
+
+
+def is_local_backend():
+    return settings.SHORTLINK_BACKEND == LOCAL_BACKEND
+
+
+def hits_key(short_link_id):
+    return f'short_link_hits_{short_link_id}'
+
+
+def ips_key(short_link_id):
+    return f'short_link_ips_{short_link_id}'
+
+
+def target_key(short_link_id):
+    return f'short_link_target_{short_link_id}'
+
+
+def new_local_shortlink(campaign_link, campaign_user_id):
+    """
+        allocate a shortlink of campaign_link for campaign user, its reference_id is its own id
+
+    :raise ShortLinkError: if clicks can not be counted, default cache is not shared by processes
+    """
+    if is_process_local_cache():
+        raise ShortLinkError('local shortlinks need a default cache which is shared by processes')
+
+    with transaction.atomic():
+        short_link = ShortLink.objects.create(
+            campaign_link=campaign_link,
+            campaign_user_id=campaign_user_id,
+            claimed_time=timezone.now(),
+            reference_id=0,
+            utm_content=str(campaign_link.extra_data.get("utm_content", campaign_user_id)),
+        )
+        short_link.reference_id = short_link.id
+        short_link.link = f'{settings.SHORTLINK_BASE_URL}{url_encoder.encode_id(short_link.id)}'
+        short_link.save(update_fields=['reference_id', 'link'])
+    return short_link
+
+
+def target_url(short_link):
+    """
+        link of campaign_link with its UTM params, params of the link itself are kept
+    """
+    campaign_link = short_link.campaign_link
+    scheme, netloc, path, query, fragment = urlsplit(campaign_link.link)
+    params = dict(parse_qsl(query))
+    params.update({
+        param: campaign_link.extra_data[param]
+        for param in UTM_PARAMS if campaign_link.extra_data.get(param) is not None
+    })
+    if short_link.utm_content:
+        params['utm_content'] = short_link.utm_content
+    return urlunsplit((scheme, netloc, path, urlencode(params), fragment))
+
+
+def resolve(code):
+    """
+    :return: (short_link_id, target url) of code, target is None if code is not a shortlink
+    """
+    short_link_id = url_encoder.decode_id(code)
+    target = cache.get(target_key(short_link_id))
+    if target is None:
+        short_link = ShortLink.objects.select_related('campaign_link').filter(id=short_link_id).first()
+        if short_link is None:
+            return short_link_id, None
+        target = target_url(short_link)
+        cache.set(target_key(short_link_id), target, TARGET_CACHE_TIMEOUT)
+    return short_link_id, target
+
+
+def increase(key):
+    if cache.add(key, 1, None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # key is expired or evicted after add
+        cache.add(key, 1, None)
+
+
+def count_click(short_link_id, ip):
+    """
+        count a hit, and a unique ip if ip is not seen for the link in SHORTLINK_UNIQUE_IP_TIMEOUT seconds
+    """
+    increase(hits_key(short_link_id))
+    ip_key = f'short_link_ip_{short_link_id}_{hashlib.md5(ip.encode()).hexdigest()}'
+    if cache.add(ip_key, 1, settings.SHORTLINK_UNIQUE_IP_TIMEOUT):
+        increase(ips_key(short_link_id))
+
+
+def read_clicks(short_link_ids):
+    """
+        clicks of shortlinks counted since they are released last time
+
+    :return: {short_link_id: (hits, ips)} of links which have clicks
+    """
+    keys = [hits_key(short_link_id) for short_link_id in short_link_ids]
+    keys += [ips_key(short_link_id) for short_link_id in short_link_ids]
+    counters = cache.get_many(keys)
+
+    clicks = {}
+    for short_link_id in short_link_ids:
+        hits = counters.get(hits_key(short_link_id), 0)
+        ips = counters.get(ips_key(short_link_id), 0)
+        if hits or ips:
+            clicks[short_link_id] = (hits, ips)
+    return clicks
+
+
+def release_clicks(clicks):
+    """
+        remove clicks which are written to logs from counters, clicks counted after reading them are kept
+    """
+    for short_link_id, (hits, ips) in clicks.items():
+        for key, count in ((hits_key(short_link_id), hits), (ips_key(short_link_id), ips)):
+            if not count:
+                continue
+            try:
+                cache.decr(key, count)
+            except ValueError:
+                pass
+
+
+def client_ip(request):
+    """
+        REMOTE_ADDR, or the address which the first of SHORTLINK_TRUSTED_PROXIES proxies in front of
+        the site added to X-Forwarded-For. addresses before it are sent by the client and are not trusted
+    """
+    proxies = settings.SHORTLINK_TRUSTED_PROXIES
+    forwarded_for = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and len(forwarded_for) >= proxies:
+        return forwarded_for[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
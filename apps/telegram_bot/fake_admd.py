@@ -0,0 +1,143 @@
+"""
+    a local stand-in of ADMD shortlink api for load tests, see `fake_admd` and `benchmark_shortlinks` commands
+
+    * POST <path>        creates a shortlink, {"id", "short_url"}
+    * GET <path><id>     stats of a shortlink, {"hit_count", "ip_count"} with ETag, 304 if it is not modified
+    * POST <path>batch   stats of {"ids": [...]}, list of {"id", "hit_count", "ip_count"}
+
+    every call waits `latency` plus a random `jitter` milliseconds, fails with 500 by `error_rate` and gets 429
+    when more than `throttle` calls per second are received (0 is unlimited). stats grow by `click_rate`
+    on every read to look like live links
+"""
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeAdmd:
+    def __init__(self, latency=50, jitter=50, error_rate=0.0, throttle=0, click_rate=0.3):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.click_rate = click_rate
+        self.links = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._tokens = throttle
+        self._refill_time = time.monotonic()
+
+    def throttled(self):
+        """
+            token bucket of `throttle` calls per second
+        """
+        if not self.throttle:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.throttle, self._tokens + (now - self._refill_time) * self.throttle)
+            self._refill_time = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+    def create(self, payload):
+        with self._lock:
+            link_id = len(self.links) + 1
+            self.links[link_id] = [0, 0]
+        return {'id': link_id, 'short_url': f'http://fake.admd/{link_id}', 'dest_url': payload.get('dest_url')}
+
+    def stats(self, link_id):
+        with self._lock:
+            counts = self.links.get(link_id)
+            if counts is None:
+                return None
+            if random.random() < self.click_rate:
+                hits = random.randint(1, 5)
+                counts[0] += hits
+                counts[1] += random.randint(0, hits)
+            return {'id': link_id, 'hit_count': counts[0], 'ip_count': counts[1]}
+
+
+class FakeAdmdHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body=None, headers=None):
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def admit(self):
+        """
+            apply latency, throttling and errors, False if the call is already answered
+        """
+        admd = self.server.admd
+        admd.requests += 1
+        time.sleep((admd.latency + random.uniform(0, admd.jitter)) / 1000)
+        if admd.throttled():
+            self.respond(429, {'detail': 'throttled'}, {'Retry-After': '1'})
+            return False
+        if random.random() < admd.error_rate:
+            self.respond(500, {'detail': 'fake error'})
+            return False
+        return True
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.admit():
+            return
+
+        if self.path.rstrip('/').endswith('batch'):
+            stats = [self.server.admd.stats(link_id) for link_id in payload.get('ids', [])]
+            self.respond(200, [link_stats for link_stats in stats if link_stats is not None])
+        else:
+            self.respond(201, self.server.admd.create(payload))
+
+    def do_GET(self):
+        if not self.admit():
+            return
+
+        try:
+            link_id = int(self.path.rstrip('/').rsplit('/', 1)[-1])
+        except ValueError:
+            return self.respond(404, {'detail': 'not found'})
+        stats = self.server.admd.stats(link_id)
+        if stats is None:
+            return self.respond(404, {'detail': 'not found'})
+
+        etag = f'"{stats["hit_count"]}-{stats["ip_count"]}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.respond(304)
+        self.respond(200, stats, {'ETag': etag})
+
+
+def make_server(host='127.0.0.1', port=0, **options):
+    """
+        fake ADMD http server, port 0 binds a free port. run it by `serve_forever`
+
+    :param options: FakeAdmd options
+    """
+    server = ThreadingHTTPServer((host, port), FakeAdmdHandler)
+    server.daemon_threads = True
+    server.admd = FakeAdmd(**options)
+    return server
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """
+        fake ADMD server running in a daemon thread
+
+    :return: (server, api url)
+    """
+    server = make_server(host, port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}/api/links/'
@@ -0,0 +1,138 @@
+import time
+import hashlib
+
+from django.core.cache import caches
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from apps.tel_tools.pool import TelegramSessionPool
+from apps.telegram_adv.models import CampaignPost
+from apps.telegram_bot.views_reader import VIEWS_METHOD, read_posts_views, save_posts_views
+
+# failed readings of a batch before its unread posts are skipped
+BATCH_RETRIES = 3
+
+
+def parse_time(value):
+    time = parse_datetime(value)
+    if time is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f"invalid date: {value}")
+        time = timezone.datetime.combine(date, timezone.datetime.min.time())
+    return time
+
+
+class Command(BaseCommand):
+    help = 'Read and log current views of posts of campaigns or of a date range in checkpointed batches, ' \
+           'an interrupted run continues from its last completed batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign',
+                            dest='campaigns',
+                            type=int,
+                            action='append',
+                            default=[],
+                            help='campaign id, can be repeated')
+        parser.add_argument('--from',
+                            dest='from_time',
+                            help='posts of campaigns which are running after this date')
+        parser.add_argument('--to',
+                            dest='to_time',
+                            help='posts of campaigns which are started before this date')
+        parser.add_argument('--batch',
+                            dest='batch',
+                            type=int,
+                            default=500,
+                            help='posts read and written in each batch')
+        parser.add_argument('--restart',
+                            dest='restart',
+                            action='store_true',
+                            help='ignore the checkpoint of a previous run')
+
+    def handle(self, *args, **options):
+        if not any([options['campaigns'], options['from_time'], options['to_time']]):
+            raise CommandError('pass --campaign or a date range')
+
+        campaign_posts = CampaignPost.objects.filter(
+            message_id__isnull=False,
+            read_error='',
+        )
+        if options['campaigns']:
+            campaign_posts = campaign_posts.filter(campaign_user__campaign_id__in=options['campaigns'])
+        if options['from_time']:
+            campaign_posts = campaign_posts.filter(
+                campaign_user__campaign__end_datetime__gte=parse_time(options['from_time'])
+            )
+        if options['to_time']:
+            campaign_posts = campaign_posts.filter(
+                campaign_user__campaign__start_datetime__lte=parse_time(options['to_time'])
+            )
+
+        checkpoint_cache = caches['session']
+        scope = f"{sorted(options['campaigns'])}_{options['from_time']}_{options['to_time']}"
+        checkpoint_key = f'backfill_posts_views_{hashlib.md5(scope.encode()).hexdigest()}'
+        if options['restart']:
+            checkpoint_cache.delete(checkpoint_key)
+        last_id = checkpoint_cache.get(checkpoint_key, 0)
+        if last_id:
+            self.stdout.write(f"continue after post: {last_id}")
+
+        post_ids = list(campaign_posts.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+        started = time.time()
+        read_count = 0
+        flagged_count = 0
+        for i in range(0, len(post_ids), options['batch']):
+            batch_ids = post_ids[i:i + options['batch']]
+            batch_posts = list(CampaignPost.objects.select_related(
+                'campaign_content__mother_channel'
+            ).filter(
+                id__in=batch_ids
+            ).order_by('id'))
+
+            unread = {campaign_post.id: campaign_post for campaign_post in batch_posts}
+            for _ in range(BATCH_RETRIES):
+                results = read_posts_views(list(unread.values()), flood_sleep_threshold=0)
+                save_posts_views(results, log_mode=True, update_views=False)
+                for posts, _views in results:
+                    for campaign_post in posts:
+                        unread.pop(campaign_post.id, None)
+                        read_count += 1
+                # posts which are flagged by a permanent read error are not read again
+                for post_id in CampaignPost.objects.filter(
+                        id__in=list(unread)
+                ).exclude(
+                    read_error=''
+                ).values_list('id', flat=True):
+                    unread.pop(post_id)
+                    flagged_count += 1
+                if not unread:
+                    break
+
+                # wait for the flood budget instead of spending it on retries
+                wait = TelegramSessionPool().wait_time(VIEWS_METHOD)
+                if wait is None:
+                    break
+                self.stdout.write(f"{len(unread)} posts remained, waiting {wait:.0f} seconds for sessions")
+                time.sleep(wait)
+
+            # the checkpoint never passes an unread post
+            first_unread = min(unread, default=None)
+            done_ids = [post_id for post_id in batch_ids if first_unread is None or post_id < first_unread]
+            if done_ids:
+                checkpoint_cache.set(checkpoint_key, done_ids[-1], None)
+            if unread:
+                raise CommandError(
+                    f"{len(unread)} posts are not read, no session can read them now. "
+                    f"{read_count} posts are read, run again to continue from post: {first_unread}"
+                )
+
+            elapsed = time.time() - started
+            self.stdout.write(
+                f"{min(i + options['batch'], len(post_ids))} of {len(post_ids)} posts, {read_count} read, "
+                f"{flagged_count} flagged, {read_count / elapsed if elapsed else 0:.1f} posts per second"
+            )
+
+        checkpoint_cache.delete(checkpoint_key)
+        self.stdout.write(self.style.SUCCESS(f"{read_count} posts read in {time.time() - started:.0f} seconds"))
@@ -0,0 +1,172 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.telegram_adv.models import (
+    Campaign,
+    CampaignContent,
+    CampaignLink,
+    CampaignPost,
+    CampaignUser,
+    ShortLink,
+    TelegramAgent,
+)
+from apps.telegram_bot.admd import admd
+from apps.telegram_bot.exceptions import ShortLinkError
+from apps.telegram_bot.fake_admd import start_server
+from apps.telegram_bot.management.commands.fake_admd import add_server_arguments, server_options
+from apps.telegram_bot.tasks import render_text_and_inline, fill_pools, write_short_links_logs, stats_etag_key
+from apps.telegram_user.models import TelegramUser
+
+BENCHMARK_LINK = 'https://example.com/benchmark'
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark shortlink rendering and stats collection against a fake ADMD, ' \
+           'benchmark rows are rolled back and nothing is kept in database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--links',
+                            dest='links',
+                            type=int,
+                            default=200,
+                            help='renders of the benchmark content, each one needs a shortlink')
+        parser.add_argument('--url',
+                            dest='url',
+                            help='api url of a running fake_admd, default starts one with the given options')
+        parser.add_argument('--batch',
+                            dest='batch',
+                            action='store_true',
+                            help='read stats by the batch endpoint')
+        parser.add_argument('--workers',
+                            dest='workers',
+                            type=int,
+                            help='concurrent ADMD calls, default is ADMD_WORKERS')
+        add_server_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = None
+        api_url = options['url']
+        if not api_url:
+            server, api_url = start_server(**server_options(options))
+
+        settings.ADMD_API_URL = api_url
+        settings.ADMD_STATS_BATCH_URL = f'{api_url}batch' if options['batch'] else ''
+        settings.SHORTLINK_BACKEND = 'admd'
+        settings.SHORTLINK_POOL_SIZE = settings.SHORTLINK_POOL_MIN = options['links']
+        if options['workers']:
+            settings.ADMD_WORKERS = options['workers']
+            # connection pool is sized by workers
+            admd._session = None
+        # failures of the fake server must not open the circuit of the real one
+        circuit_prefix = admd.circuit_prefix
+        admd.circuit_prefix = f'benchmark_admd_circuit_{uuid.uuid4().hex}'
+
+        # time every ADMD call
+        self.calls = []
+        self.errors = 0
+        send = admd.send
+
+        def timed_send(*send_args, **send_kwargs):
+            started = time.perf_counter()
+            try:
+                return send(*send_args, **send_kwargs)
+            except ShortLinkError:
+                self.errors += 1
+                raise
+            finally:
+                self.calls.append(time.perf_counter() - started)
+
+        admd.send = timed_send
+        try:
+            with transaction.atomic():
+                self.run(options['links'])
+                transaction.set_rollback(True)
+        finally:
+            del admd.send
+            cache.delete_many([admd.open_key, admd.failures_key])
+            admd.circuit_prefix = circuit_prefix
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    def measure(self, name, function, repeat=1, count=None):
+        """
+            call function `repeat` times and report `count` (default repeat) operations per second,
+            latency of calls and of ADMD calls in them
+        """
+        self.calls.clear()
+        self.errors = 0
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            call_started = time.perf_counter()
+            function()
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+
+        count = repeat if count is None else count
+        report = f"{name}: {count} in {elapsed:.2f}s, {count / elapsed if elapsed else 0:.1f}/s"
+        if repeat > 1:
+            report += f", latency p50 {percentile(latencies, 50) * 1000:.0f}ms " \
+                      f"p95 {percentile(latencies, 95) * 1000:.0f}ms p99 {percentile(latencies, 99) * 1000:.0f}ms"
+        report += f", admd calls {len(self.calls)} p50 {percentile(self.calls, 50) * 1000:.0f}ms " \
+                  f"p99 {percentile(self.calls, 99) * 1000:.0f}ms, failed {self.errors}"
+        self.stdout.write(report)
+
+    def run(self, links_count):
+        now = timezone.now()
+        campaign = Campaign.objects.create(
+            title='benchmark',
+            max_view=1,
+            is_enable=True,
+            status=Campaign.STATUS_APPROVED,
+            start_datetime=now,
+            end_datetime=now + timezone.timedelta(days=1),
+        )
+        campaign_content = CampaignContent.objects.create(
+            campaign=campaign,
+            display_text='benchmark',
+            content=f'<a href="{BENCHMARK_LINK}">benchmark</a>',
+            view_type=CampaignContent.TYPE_VIEW_PARTIAL,
+        )
+        campaign_link = CampaignLink.objects.create(campaign_content=campaign_content, link=BENCHMARK_LINK)
+        user, _ = TelegramUser.objects.get_or_create(user_id=0)
+        agent, _ = TelegramAgent.objects.get_or_create(
+            bot_token='benchmark', defaults=dict(bot_name='benchmark', specific_mark='benchmark')
+        )
+        campaign_user = CampaignUser.objects.create(
+            campaign=campaign, user=user, agent=agent, sheba_number='-', sheba_owner='-'
+        )
+        campaign_post = CampaignPost.objects.create(campaign_content=campaign_content, campaign_user=campaign_user)
+
+        def render():
+            render_text_and_inline(campaign_content, campaign_user.id)
+
+        # only the benchmark link and its shortlinks are used, other campaigns are not touched
+        self.measure('render by admd', render, links_count)
+        self.measure(
+            'fill pool', lambda: fill_pools(CampaignLink.objects.filter(id=campaign_link.id)), count=links_count
+        )
+        self.measure('render by pool', render, links_count)
+
+        short_links = ShortLink.objects.filter(campaign_link=campaign_link)
+        short_links.update(campaign_post=campaign_post)
+        short_links = list(short_links.only('id', 'reference_id', 'hit_count', 'ip_count').order_by('id'))
+        try:
+            self.measure('stats', lambda: write_short_links_logs(short_links), count=len(short_links))
+            self.measure('stats again', lambda: write_short_links_logs(short_links), count=len(short_links))
+        finally:
+            cache.delete_many([stats_etag_key(short_link.reference_id) for short_link in short_links])
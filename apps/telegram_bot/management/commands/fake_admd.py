@@ -0,0 +1,61 @@
+from django.core.management import BaseCommand
+
+from apps.telegram_bot.fake_admd import make_server
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--latency',
+                        dest='latency',
+                        type=float,
+                        default=50,
+                        help='milliseconds every call waits')
+    parser.add_argument('--jitter',
+                        dest='jitter',
+                        type=float,
+                        default=50,
+                        help='random milliseconds added to latency')
+    parser.add_argument('--error-rate',
+                        dest='error_rate',
+                        type=float,
+                        default=0.0,
+                        help='fraction of calls which fail with 500')
+    parser.add_argument('--throttle',
+                        dest='throttle',
+                        type=int,
+                        default=0,
+                        help='calls per second before 429 responses, 0 is unlimited')
+    parser.add_argument('--click-rate',
+                        dest='click_rate',
+                        type=float,
+                        default=0.3,
+                        help='chance of new clicks on every stats read')
+
+
+def server_options(options):
+    return {option: options[option] for option in ('latency', 'jitter', 'error_rate', 'throttle', 'click_rate')}
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake ADMD shortlink api with configurable latency, errors and throttling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host',
+                            dest='host',
+                            default='127.0.0.1')
+        parser.add_argument('--port',
+                            dest='port',
+                            type=int,
+                            default=8765)
+        add_server_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = make_server(options['host'], options['port'], **server_options(options))
+        self.stdout.write(f"fake ADMD is running, ADMD_API_URL=http://{options['host']}:{options['port']}/api/links/ "
+                          f"ADMD_STATS_BATCH_URL=http://{options['host']}:{options['port']}/api/links/batch")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"{server.admd.requests} calls served")
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from apps.telegram_adv.models import CampaignPost, CampaignPostPoll
+from apps.telegram_bot.tasks import valid_campaign_post_ids
+
+
+class Command(BaseCommand):
+    help = 'Add posts of open campaigns which are not in views poll queue'
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        post_ids = CampaignPost.objects.filter(
+            id__in=valid_campaign_post_ids(),
+            message_id__isnull=False,
+            views__isnull=True,
+            read_error='',
+            poll__isnull=True
+        ).values_list('id', flat=True)
+
+        polls = CampaignPostPoll.objects.bulk_create(
+            [CampaignPostPoll(campaign_post_id=post_id, next_poll_time=now) for post_id in post_ids],
+            batch_size=1000
+        )
+        self.stdout.write(f"{len(polls)} posts added to poll queue")
@@ -0,0 +1,180 @@
+import math
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from apps.telegram_adv.forecast import filling_campaign_ids
+from apps.telegram_adv.models import CampaignPostLog, CampaignPostPoll
+
+logger = logging.getLogger(__name__)
+
+QUERY_CHUNK_SIZE = 1000
+
+
+def poll_interval(age, views, velocity):
+    """
+        time until the next views reading of a post
+
+        * age: fresh posts are polled every cycle, the longest allowed interval doubles every
+          VIEWS_POLL_AGE_DOUBLING hours of post age up to VIEWS_POLL_MAX_INTERVAL
+        * velocity: time that post views need to grow VIEWS_POLL_GROWTH_STEP of its views
+          with its recent velocity, flat posts reach their age limit
+
+    :param age: timedelta since post creation
+    :param views: last read views
+    :param velocity: views per hour in recent logs, None if not enough logs yet
+    :return: timedelta
+    """
+    min_interval = settings.VIEWS_POLL_MIN_INTERVAL * 60
+    age_doublings = min(age.total_seconds() / 3600 / settings.VIEWS_POLL_AGE_DOUBLING, 32)
+    max_interval = max(min(settings.VIEWS_POLL_MAX_INTERVAL * 60, min_interval * 2 ** age_doublings), min_interval)
+
+    if velocity is None:
+        interval = min_interval
+    elif velocity <= 0:
+        interval = max_interval
+    else:
+        interval = settings.VIEWS_POLL_GROWTH_STEP * max(views, 1) / velocity * 3600
+
+    return timezone.timedelta(seconds=min(max(interval, min_interval), max_interval))
+
+
+def views_velocities(readings, now):
+    """
+        views per hour of posts in the last VIEWS_VELOCITY_WINDOW hours until now.
+
+        logs are written on change, so the views at the start of window is the latest log before it,
+        which is not older than VIEWS_LOG_HEARTBEAT. posts without such a log are measured from their
+        earliest log in window
+
+    :param readings: {campaign_post_id: current views}
+    :param now:
+    :return: {campaign_post_id: views per hour} only for posts which have logs
+    """
+    since = now - timezone.timedelta(hours=settings.VIEWS_VELOCITY_WINDOW)
+    logs_since = since - timezone.timedelta(minutes=settings.VIEWS_LOG_HEARTBEAT)
+    post_ids = list(readings)
+    base_logs = {}
+    for i in range(0, len(post_ids), QUERY_CHUNK_SIZE):
+        logs = CampaignPostLog.objects.filter(
+            campaign_post_id__in=post_ids[i:i + QUERY_CHUNK_SIZE],
+            created_time__gte=logs_since,
+        ).order_by(
+            'created_time'
+        ).values_list(
+            'campaign_post_id', 'created_time', 'banner_views'
+        )
+        for campaign_post_id, created_time, banner_views in logs:
+            if created_time <= since:
+                base_logs[campaign_post_id] = (since, banner_views)
+            else:
+                base_logs.setdefault(campaign_post_id, (created_time, banner_views))
+
+    velocities = {}
+    for campaign_post_id, (created_time, banner_views) in base_logs.items():
+        hours = (now - created_time).total_seconds() / 3600
+        if hours > 0:
+            velocities[campaign_post_id] = (readings[campaign_post_id] - banner_views) / hours
+
+    return velocities
+
+
+def next_poll_times(campaign_posts, now):
+    """
+        next poll time of posts which their views are just read,
+        posts of campaigns which are forecast to fill soon are polled every VIEWS_POLL_MIN_INTERVAL
+
+    :param campaign_posts: posts with fresh `views`
+    :param now:
+    :return: {campaign_post_id: next poll time}
+    """
+    velocities = views_velocities({cp.id: cp.views for cp in campaign_posts}, now)
+    filling_ids = filling_campaign_ids(settings.VIEWS_FORECAST_POLL_HORIZON, now)
+    min_interval = timezone.timedelta(minutes=settings.VIEWS_POLL_MIN_INTERVAL)
+    return {
+        campaign_post.id: now + (
+            min_interval if campaign_post.campaign_content.campaign_id in filling_ids else poll_interval(
+                now - campaign_post.created_time,
+                campaign_post.views,
+                velocities.get(campaign_post.id)
+            )
+        )
+        for campaign_post in campaign_posts
+    }
+
+
+def read_calls(messages, unread_messages, batch_size):
+    """
+        most MTProto calls which reading `messages` messages of a channel needs. every id batch of `batch_size`
+        messages is one getMessagesViews call and one getMessages probe if it has a message without views yet.
+        a range sweep is only chosen when it needs no more calls than that
+    """
+    batches = math.ceil(messages / batch_size)
+    return batches + min(batches, unread_messages)
+
+
+def within_call_budget(campaign_posts, budget, batch_size):
+    """
+        posts in their order which `budget` calls can read, views batches, missing message probes and
+        range sweeps are all charged by read_calls. posts of a message are read once
+
+    :param campaign_posts: posts with their campaign_content, most overdue first
+    :param budget: max MTProto calls
+    :param batch_size: message ids of one call
+    :return: (posts to read, posts which are left to the next cycle)
+    """
+    channels_messages = {}
+    channels_unread = {}
+    calls = 0
+    selected_posts = []
+    deferred_posts = []
+    for campaign_post in campaign_posts:
+        mother_channel_id = campaign_post.campaign_content.mother_channel_id
+        messages = channels_messages.setdefault(mother_channel_id, set())
+        if campaign_post.message_id not in messages:
+            unread = channels_unread.get(mother_channel_id, 0)
+            new_unread = unread if campaign_post.latest_views else unread + 1
+            new_calls = read_calls(len(messages) + 1, new_unread, batch_size) - read_calls(
+                len(messages), unread, batch_size
+            )
+            if calls + new_calls > budget:
+                deferred_posts.append(campaign_post)
+                continue
+            calls += new_calls
+            messages.add(campaign_post.message_id)
+            channels_unread[mother_channel_id] = new_unread
+        selected_posts.append(campaign_post)
+
+    logger.debug(f"posts: {len(selected_posts)} in {calls} calls of budget: {budget}, deferred: {len(deferred_posts)}")
+    return selected_posts, deferred_posts
+
+
+def reschedule_polls(polls, lease_owner, poll_times):
+    """
+        release leased polls with their new time, polls which their lease is expired and claimed
+        by another worker are left to that worker
+
+    :param polls: CampaignPostPoll claimed by lease_owner
+    :param lease_owner:
+    :param poll_times: {campaign_post_id: next poll time}, missing posts are retried after the min interval
+    """
+    retry_time = timezone.now() + timezone.timedelta(minutes=settings.VIEWS_POLL_MIN_INTERVAL)
+    owned_ids = set(CampaignPostPoll.objects.filter(
+        id__in=[poll.id for poll in polls],
+        lease_owner=lease_owner
+    ).values_list('id', flat=True))
+
+    owned_polls = [poll for poll in polls if poll.id in owned_ids]
+    for poll in owned_polls:
+        poll.next_poll_time = poll_times.get(poll.campaign_post_id, retry_time)
+        poll.lease_owner = ''
+        poll.lease_expire_time = None
+
+    CampaignPostPoll.objects.bulk_update(
+        owned_polls,
+        ['next_poll_time', 'lease_owner', 'lease_expire_time'],
+        batch_size=QUERY_CHUNK_SIZE
+    )
+    if len(owned_polls) < len(polls):
+        logger.warning(f"{len(polls) - len(owned_polls)} polls of {lease_owner} were claimed by other workers")
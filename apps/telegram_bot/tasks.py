@@ -1,36 +1,46 @@
-import requests
+import math
+import uuid
 import logging
-from time import sleep
 
 from django.conf import settings
 from django.utils import timezone
 from django.template import Template, Context
 from django.db import transaction
+from django.db.models import F, Q, Count
+from django.core.cache import cache
 
 from celery import shared_task
-from telethon.sync import TelegramClient
-from telethon.sessions import StringSession
 from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.errors import FloodWaitError
 from telethon.utils import pack_bot_file_id
 
 from telegram import Bot, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.utils.request import Request
 
-from . import texts, buttons
+from . import texts, buttons, clicks
+from .views_reader import read_posts_views, save_posts_views, VIEWS_BATCH_SIZE
+from .scheduler import next_poll_times, reschedule_polls, within_call_budget
+from .admd import admd
 from apps.utils.url_encoder import UrlEncoder
 from apps.utils.html import filter_escape
 from apps.telegram_bot.exceptions import ShortLinkError
 from apps.push.models import PushText, CampaignPush, CampaignPushUser
 from apps.push.tasks import send_push_to_user
 from apps.tel_tools.models import TelegramSession
+from apps.tel_tools.pool import session_pool
+from apps.tel_tools.worker import forward_to_worker
+from apps.tel_tools.exceptions import NoSessionAvailable
+from apps.telegram_adv.forecast import filling_campaign_ids
+from apps.telegram_adv.tasks import disable_campaign_by_max_view
 from apps.telegram_adv.models import (
     Campaign,
     CampaignPost,
     CampaignUser,
     CampaignContent,
     CampaignFile,
-    CampaignPostLog,
+    CampaignLink,
+    CampaignPostPoll,
     ShortLink,
     ShortLinkLog,
     TelegramChannel,
@@ -40,22 +50,14 @@ from apps.telegram_adv.models import (
 
 logger = logging.getLogger(__name__)
 
-TELETHON_PROXY = None
-if settings.PROXY4TELEGRAM_HOST:
-    # import os
-    import socks
-
-    TELETHON_PROXY = (
-        socks.HTTP,
-        settings.PROXY4TELEGRAM_HOST,
-        settings.PROXY4TELEGRAM_PORT,
-        # True,
-        # settings.PROXY4TELEGRAM_USER,
-        # settings.PROXY4TELEGRAM_PASS,
-    )
-    # PROXY4TELEGRAM = f'http://{settings.PROXY4TELEGRAM_HOST}:{settings.PROXY4TELEGRAM_PORT}'
-    # os.environ['http_proxy'] = PROXY4TELEGRAM
-    # os.environ['https_proxy'] = PROXY4TELEGRAM
+# posts of finished campaigns read and written together when settling views
+SETTLE_BATCH_SIZE = 1000
+# shortlinks which their stats are read and written together
+SHORT_LINK_LOGS_CHUNK = 1000
+# seconds an ETag of shortlink stats is kept
+STATS_ETAG_TIMEOUT = 2 * 86400
+# seconds which poll workers queue disable_campaign_by_max_view at most once in
+DISABLE_BY_MAX_VIEW_QUEUE_TIMEOUT = 60
 
 bot_settings = settings.TELEGRAM_BOT
 proxy_url = None
@@ -75,11 +77,6 @@ bot = Bot(
 )
 
 
-def _get_telegram_admin_user():
-    # TODO: change this and get by admin type: view, fraud, ....
-    return TelegramSession.objects.first()
-
-
 @shared_task
 def upload_file(obj_id, push=False):
     if push:
@@ -122,70 +119,181 @@ def upload_file(obj_id, push=False):
 
 @shared_task
 def get_files_id(campaign_content_id, channel_id, admin_id, file_type, from_msg_id, to_msg_id):
+    """
+        import files of channel messages between from_msg_id and to_msg_id as CampaignFile,
+        messages are read from the newest one so on FloodWait the task is rescheduled for the
+        remaining older messages instead of sleeping in the worker
+    """
+    if forward_to_worker(get_files_id, campaign_content_id, channel_id, admin_id, file_type, from_msg_id, to_msg_id):
+        return
+
     campaign_content = CampaignContent.objects.get(id=campaign_content_id)
     channel = ReceiverChannel.objects.get(id=channel_id)
     admin = TelegramSession.objects.get(id=admin_id)
 
     campaign_files = []
+    task_args = [campaign_content_id, channel_id, admin_id, file_type, from_msg_id]
 
-    with TelegramClient(StringSession(admin.session), admin.api_id, admin.api_hash, proxy=TELETHON_PROXY) as client:
-        client.session.save_entities = False
-        client.flood_sleep_threshold = 0
-        messages = client.iter_messages(channel.chat_id, min_id=max(from_msg_id - 1, 1), max_id=to_msg_id + 1)
-        for message in messages:
-            try:
-                file_id = pack_bot_file_id(message.media)
-                if not CampaignFile.objects.filter(campaign_content=campaign_content,
-                                                   telegram_file_hash=file_id).exists():
-                    campaign_files.append(
-                        CampaignFile(
-                            name=f"{campaign_content.display_text} {file_type} {message.id}",
-                            telegram_file_hash=file_id,
-                            file_type=file_type,
-                            campaign_content=campaign_content
+    with session_pool(sessions=[admin], flood_sleep_threshold=0) as pool:
+        wait = pool.take(admin, GetHistoryRequest.__name__)
+        if wait:
+            get_files_id.apply_async(args=[*task_args, to_msg_id], countdown=wait)
+            return
+
+        client = pool.client(admin)
+        last_message_id = to_msg_id + 1
+        try:
+            for message in client.iter_messages(channel.chat_id, min_id=max(from_msg_id - 1, 1), max_id=to_msg_id + 1):
+                last_message_id = message.id
+                try:
+                    file_id = pack_bot_file_id(message.media)
+                    if not CampaignFile.objects.filter(campaign_content=campaign_content,
+                                                       telegram_file_hash=file_id).exists():
+                        campaign_files.append(
+                            CampaignFile(
+                                name=f"{campaign_content.display_text} {file_type} {message.id}",
+                                telegram_file_hash=file_id,
+                                file_type=file_type,
+                                campaign_content=campaign_content
+                            )
                         )
+                except Exception as e:
+                    logger.error(
+                        f"import file for CampaignContent: {campaign_content_id} message: {message} failed, error: {e}"
                     )
-            except FloodWaitError as e:
-                sleep(e.seconds)
-            except Exception as e:
-                logger.error(
-                    f"import file for CampaignContent: {campaign_content_id} message: {message} failed, error: {e}"
-                )
-                break
-        admin.session = client.session.save()
-        admin.save()
+                    break
+
+        except FloodWaitError as e:
+            pool.report_error(admin, e)
+            logger.warning(f"import files for CampaignContent: {campaign_content_id} rescheduled from message: "
+                           f"{last_message_id - 1} in {e.seconds} seconds")
+            get_files_id.apply_async(args=[*task_args, last_message_id - 1], countdown=e.seconds)
 
     CampaignFile.objects.bulk_create(campaign_files)
 
 
+def new_shortlink(campaign_link, campaign_title, utm_content):
+    """
+        create a shortlink of campaign_link on ADMD
+
+    :return: unsaved ShortLink
+    :raise ShortLinkError: if ADMD did not create it
+    """
+    payload = {
+        'title': campaign_title,
+        'dest_url': campaign_link.link,
+        'utm_source': campaign_link.extra_data.get("utm_source"),
+        'utm_medium': campaign_link.extra_data.get("utm_medium"),
+        'utm_campaign': campaign_link.extra_data.get("utm_campaign"),
+        'utm_term': campaign_link.extra_data.get("utm_term"),
+        'utm_content': utm_content,
+    }
+    try:
+        result = admd.create_shortlink(payload)
+    except ShortLinkError as e:
+        logger.error(f"creating shortlink failed, payload: {payload}, error: {e}")
+        raise
+
+    return ShortLink(
+        campaign_link=campaign_link,
+        link=result['short_url'],
+        reference_id=result['id'],
+        utm_content=str(utm_content),
+    )
+
+
 def get_shortlink(campaign_link, campaign_title, campaign_user_id):
-    for i in range(10):
-        try:
-            payload = {
-                'title': campaign_title,
-                'dest_url': campaign_link.link,
-                'utm_source': campaign_link.extra_data.get("utm_source"),
-                'utm_medium': campaign_link.extra_data.get("utm_medium"),
-                'utm_campaign': campaign_link.extra_data.get("utm_campaign"),
-                'utm_term': campaign_link.extra_data.get("utm_term"),
-                'utm_content': campaign_link.extra_data.get("utm_content", campaign_user_id),
-            }
-            r = requests.post(f'{settings.ADMD_API_URL}',
-                              json=payload,
-                              headers={'Authorization': settings.ADMD_API_TOKEN})
-            r.raise_for_status()
-            result = r.json()
-        except requests.HTTPError:
-            logger.error(f'requests error: {r.status_code}, body: {r.text}, payload: {payload}')
-        except Exception as e:
-            logger.error(f'This exception occurred because of {e}')
-        else:
-            shortlink = ShortLink.objects.create(
-                campaign_link=campaign_link,
-                link=result['short_url'],
-                reference_id=result['id'],
-            )
-            return shortlink
+    """
+        claim a pooled shortlink of campaign_link for campaign user, ADMD is called only if the pool is empty
+
+    :raise ShortLinkError: if ADMD did not create it
+    """
+    if clicks.is_local_backend():
+        return clicks.new_local_shortlink(campaign_link, campaign_user_id)
+
+    short_link = ShortLink.objects.claim(campaign_link, campaign_user_id)
+    if short_link is None:
+        short_link = new_shortlink(
+            campaign_link, campaign_title, campaign_link.extra_data.get("utm_content", campaign_user_id)
+        )
+        short_link.campaign_user_id = campaign_user_id
+        short_link.claimed_time = timezone.now()
+        short_link.save()
+    return short_link
+
+
+@shared_task
+def fill_shortlink_pools():
+    """
+        top up pooled shortlinks of links of running approved campaigns to their recent claims, so rendering
+        a campaign does not wait for ADMD. see `fill_pools`
+
+        a pooled link has a random utm_content token (unless its CampaignLink has a fixed utm_content)
+        which is bound to the campaign user who claims it. pooled links of ended or disabled campaigns are removed
+    """
+    now = timezone.now()
+    ShortLink.objects.pool().filter(
+        Q(campaign_link__campaign_content__campaign__end_datetime__lt=now) |
+        Q(campaign_link__campaign_content__campaign__is_enable=False) |
+        Q(campaign_link__campaign_content__campaign__status__in=[Campaign.STATUS_CLOSE, Campaign.STATUS_REJECTED])
+    ).delete()
+
+    if not settings.SHORTLINK_POOL_SIZE or clicks.is_local_backend():
+        return
+
+    fill_pools(CampaignLink.objects.filter(
+        campaign_content__campaign__status=Campaign.STATUS_APPROVED,
+        campaign_content__campaign__is_enable=True,
+        campaign_content__campaign__end_datetime__gte=now,
+    ))
+
+
+def pool_size(recent_claims):
+    """
+        shortlinks a pool needs until the next fills, its claims in the last SHORTLINK_POOL_WINDOW minutes
+        between SHORTLINK_POOL_MIN and SHORTLINK_POOL_SIZE
+    """
+    return min(max(recent_claims, settings.SHORTLINK_POOL_MIN), settings.SHORTLINK_POOL_SIZE)
+
+
+def fill_pools(campaign_links):
+    """
+        top up pools of campaign_links to their `pool_size`
+
+    :param campaign_links: CampaignLink queryset
+    :return: number of created shortlinks
+    """
+    since = timezone.now() - timezone.timedelta(minutes=settings.SHORTLINK_POOL_WINDOW)
+    campaign_links = campaign_links.select_related(
+        'campaign_content__campaign'
+    ).annotate(
+        pooled=Count('short_links', filter=Q(short_links__claimed_time__isnull=True) & ~Q(short_links__utm_content='')),
+        recent_claims=Count('short_links', filter=Q(short_links__claimed_time__gte=since)),
+    )
+
+    pool_links = []
+    for campaign_link in campaign_links:
+        utm_content = campaign_link.extra_data.get("utm_content")
+        pool_links.extend(
+            (campaign_link, utm_content or uuid.uuid4().hex[:16])
+            for _ in range(pool_size(campaign_link.recent_claims) - campaign_link.pooled)
+        )
+    if not pool_links:
+        return 0
+
+    short_links = []
+    for (campaign_link, _u), short_link in admd.map(
+            lambda pool_link: new_shortlink(pool_link[0], pool_link[0].campaign_content.campaign.title, pool_link[1]),
+            pool_links
+    ):
+        if isinstance(short_link, ShortLinkError):
+            logger.warning(f"filling shortlink pool of campaign link: {campaign_link.id} failed, error: {short_link}")
+            continue
+        short_links.append(short_link)
+
+    ShortLink.objects.bulk_create(short_links)
+    logger.info(f"{len(short_links)} of {len(pool_links)} pooled shortlinks are created")
+    return len(short_links)
 
 
 def valid_campaign_post_ids(no_shot=False):
@@ -221,99 +329,164 @@ def valid_campaign_post_ids(no_shot=False):
 @shared_task
 def read_campaign_posts_views(campaign_posts, log_mode=True, update_views=False):
     if all(isinstance(x, int) for x in campaign_posts):
-        campaign_posts = CampaignPost.objects.filter(id__in=campaign_posts)
-
-    telegram_log = []
-    adm_ts = _get_telegram_admin_user()
-    total_views = {}
-    with TelegramClient(StringSession(adm_ts.session), adm_ts.api_id, adm_ts.api_hash, proxy=TELETHON_PROXY) as client:
-        client.session.save_entities = False
-        if not update_views:
-            client.flood_sleep_threshold = 20
-            client.request_retries = 2
+        if forward_to_worker(read_campaign_posts_views, campaign_posts, log_mode, update_views):
+            return
 
-        for campaign_post in campaign_posts:
-            view_type = campaign_post.campaign_content.view_type
-            view_id = campaign_post.campaign_content.id
-            try:
-                # Optimize telethon get_messages to reduce flood wait
-                if view_type == CampaignContent.TYPE_VIEW_TOTAL and total_views.get(view_id) is not None:
-                    banner_views = total_views[view_id]
-                else:
-                    banner_views = client.get_messages(
-                        campaign_post.campaign_content.mother_channel.get_id_or_tag,
-                        ids=campaign_post.message_id
-                    ).views
-                    if view_type == CampaignContent.TYPE_VIEW_TOTAL:
-                        total_views[view_id] = banner_views
-
-                campaign_post.views = banner_views
-                if update_views:
-                    campaign_post.save(update_fields=['updated_time', 'views'])
-
-                if log_mode:
-                    telegram_log.append(
-                        CampaignPostLog(
-                            campaign_post=campaign_post,
-                            banner_views=banner_views,
-                        )
-                    )
-                logger.info(
-                    f"read view for post: {campaign_post.id} and campaign: {campaign_post.campaign_content.campaign_id}")
-            except FloodWaitError as e:
-                logger.warning(
-                    f"read view for post: {campaign_post.id} and campaign: {campaign_post.campaign_content.campaign_id} failed, error: {e}")
-            except Exception as e:
-                logger.error(
-                    f"read view for post: {campaign_post.id} and campaign: {campaign_post.campaign_content.campaign_id} failed, error: {e}")
+        campaign_posts = CampaignPost.objects.select_related(
+            'campaign_content__mother_channel'
+        ).filter(
+            id__in=campaign_posts
+        )
 
-        adm_ts.session = client.session.save()
-        adm_ts.save()
+    # flood waits are not slept by telethon, they are recorded in governor and other sessions continue
+    client_options = dict(flood_sleep_threshold=0)
+    if not update_views:
+        client_options.update(request_retries=2)
 
-    if telegram_log:
-        CampaignPostLog.objects.bulk_create(telegram_log)
+    results = read_posts_views(campaign_posts, **client_options)
+    save_posts_views(results, log_mode=log_mode, update_views=update_views)
 
 
 @shared_task
 def log_campaign_post_views():
     """
-        read views for valid campaign post which their campaign is still open
+        dispatch poll workers for the due rows of campaign posts poll queue,
+        up to VIEWS_POLL_WORKERS workers each claims VIEWS_POLL_CLAIM_SIZE posts and reads as many of them
+        as its share of VIEWS_POLL_CALL_BUDGET calls can read
     """
-    campaign_posts = list(CampaignPost.objects.select_related(
-        'campaign_content'
+    due_polls = CampaignPostPoll.objects.due().count()
+    workers = min(math.ceil(due_polls / settings.VIEWS_POLL_CLAIM_SIZE), settings.VIEWS_POLL_WORKERS)
+    for _ in range(workers):
+        poll_campaign_posts_views.delay(math.ceil(settings.VIEWS_POLL_CALL_BUDGET / workers))
+
+
+@shared_task(bind=True)
+def poll_campaign_posts_views(self, call_budget=None):
+    """
+        claim a batch of due polls, read and log views of their posts and reschedule them.
+        polls of posts which their campaign is not open anymore are removed from queue and posts which
+        call_budget (default VIEWS_POLL_CALL_BUDGET) MTProto calls can not read are left due for the next cycle.
+        a crashed worker leaves its lease to expire after VIEWS_POLL_LEASE seconds
+    """
+    if forward_to_worker(poll_campaign_posts_views, call_budget):
+        return
+
+    lease_owner = self.request.id or uuid.uuid4().hex
+    polls = CampaignPostPoll.objects.claim(
+        lease_owner,
+        size=settings.VIEWS_POLL_CLAIM_SIZE,
+        lease_seconds=settings.VIEWS_POLL_LEASE
+    )
+    if not polls:
+        return
+
+    now = timezone.now()
+    campaign_posts = []
+    finished_post_ids = set()
+    for campaign_post in CampaignPost.objects.select_related(
+            'campaign_content__mother_channel',
+            'campaign_user__campaign'
     ).filter(
-        id__in=valid_campaign_post_ids(),
-        views__isnull=True
-    ).order_by('?'))
-    if campaign_posts:
-        read_campaign_posts_views(campaign_posts, log_mode=True, update_views=False)
+        id__in=[poll.campaign_post_id for poll in polls]
+    ):
+        campaign = campaign_post.campaign_user.campaign
+        if campaign.is_enable and campaign.status == Campaign.STATUS_APPROVED and campaign.end_datetime >= now \
+                and campaign_post.views is None and not campaign_post.read_error:
+            campaign_posts.append(campaign_post)
+        else:
+            finished_post_ids.add(campaign_post.id)
+
+    poll_times = {poll.campaign_post_id: poll.next_poll_time for poll in polls}
+    campaign_posts.sort(key=lambda campaign_post: poll_times[campaign_post.id])
+    campaign_posts, deferred_posts = within_call_budget(
+        campaign_posts, call_budget or settings.VIEWS_POLL_CALL_BUDGET, VIEWS_BATCH_SIZE
+    )
+
+    read_posts = []
+    try:
+        results = read_posts_views(campaign_posts, flood_sleep_threshold=0, request_retries=2)
+        save_posts_views(results, log_mode=True, update_views=False)
+        for posts, _ in results:
+            read_posts.extend(posts)
+
+        # campaigns which are about to fill are checked right after their reading, not on the next schedule
+        filling_ids = filling_campaign_ids(settings.VIEWS_FORECAST_POLL_HORIZON)
+        if any(campaign_post.campaign_content.campaign_id in filling_ids for campaign_post in read_posts) \
+                and cache.add('disable_campaign_by_max_view_queued', 1, DISABLE_BY_MAX_VIEW_QUEUE_TIMEOUT):
+            disable_campaign_by_max_view.delay()
+    finally:
+        CampaignPostPoll.objects.filter(campaign_post_id__in=finished_post_ids, lease_owner=lease_owner).delete()
+        reschedule_polls(
+            [poll for poll in polls if poll.campaign_post_id not in finished_post_ids],
+            lease_owner,
+            {
+                **{campaign_post.id: poll_times[campaign_post.id] for campaign_post in deferred_posts},
+                **next_poll_times(read_posts, timezone.now())
+            }
+        )
 
 
 @shared_task
 def deactive_campaign():
     """
-        check if timezone.now() passed the campaign end_datetime close campaign
-        fill campaign_posts views
+        settle views of posts of finished campaigns in batches and close the campaigns which all their posts
+        are settled. a post which its reading failed VIEWS_SETTLE_RETRIES times or has a permanent read error
+        is settled without views, posts which are deferred by governor or flood waits are not counted as failed
     """
+    if forward_to_worker(deactive_campaign):
+        return
 
-    finished_campaigns = Campaign.objects.filter(
+    finished_campaign_ids = list(Campaign.objects.filter(
         end_datetime__lt=timezone.now(),
         status=Campaign.STATUS_APPROVED
-    )
+    ).values_list('id', flat=True))
 
-    campaign_posts = list(CampaignPost.objects.select_related(
-        'campaign_content'
-    ).filter(
+    unsettled_posts = CampaignPost.objects.filter(
         screen_shot='',
         views__isnull=True,
-        campaign_user__campaign_id__in=finished_campaigns.values_list('id', flat=True),
-    ))
-    if campaign_posts:
-        read_campaign_posts_views(campaign_posts, log_mode=False, update_views=True)
+        read_failures__lt=settings.VIEWS_SETTLE_RETRIES,
+        read_error='',
+        campaign_user__campaign_id__in=finished_campaign_ids,
+    )
+    post_ids = list(unsettled_posts.values_list('id', flat=True))
+    for i in range(0, len(post_ids), SETTLE_BATCH_SIZE):
+        campaign_posts = list(CampaignPost.objects.select_related(
+            'campaign_content__mother_channel'
+        ).filter(
+            id__in=post_ids[i:i + SETTLE_BATCH_SIZE]
+        ))
+        failed_posts = []
+        results = read_posts_views(campaign_posts, failed_posts, flood_sleep_threshold=0)
+        save_posts_views(results, log_mode=False, update_views=True)
+
+        # posts without a message or mother channel can not be read at all
+        failed_posts.extend(
+            campaign_post for campaign_post in campaign_posts
+            if campaign_post.message_id is None or campaign_post.campaign_content.mother_channel is None
+        )
+        failed_post_ids = [campaign_post.id for campaign_post in failed_posts]
+        if failed_post_ids:
+            logger.warning(f"settling views of {len(failed_post_ids)} posts failed, posts: {failed_post_ids}")
+            CampaignPost.objects.filter(
+                id__in=failed_post_ids
+            ).update(
+                read_failures=F('read_failures') + 1
+            )
+
+    settled_campaign_ids = list(Campaign.objects.filter(
+        id__in=finished_campaign_ids
+    ).exclude(
+        id__in=unsettled_posts.values('campaign_user__campaign_id')
+    ).values_list('id', flat=True))
 
-    finished_campaigns.update(
+    Campaign.objects.filter(
+        id__in=settled_campaign_ids
+    ).update(
         status=Campaign.STATUS_CLOSE
     )
+    CampaignPostPoll.objects.filter(
+        campaign_post__campaign_user__campaign_id__in=settled_campaign_ids
+    ).delete()
 
 
 @shared_task
@@ -334,41 +507,134 @@ def process_campaign_tasks():
     check_no_shot_posts.delay()
 
 
+def stats_etag_key(reference_id):
+    return f'admd_stats_etag_{reference_id}'
+
+
+def read_short_links_stats(short_links):
+    """
+        read stats of short_links concurrently, by batches of ADMD_STATS_BATCH_URL if it is set
+        else by a conditional request of each link
+
+    :return: ({short_link: stats} of links which are read and modified, {etag key: etag} of links)
+    """
+    stats = {}
+    etags = {}
+    if settings.ADMD_STATS_BATCH_URL:
+        batches = [
+            short_links[i:i + settings.ADMD_STATS_BATCH_SIZE]
+            for i in range(0, len(short_links), settings.ADMD_STATS_BATCH_SIZE)
+        ]
+        for batch, result in admd.map(
+                lambda batch: admd.shortlinks_stats([short_link.reference_id for short_link in batch]), batches
+        ):
+            if isinstance(result, ShortLinkError):
+                logger.error(f"reading logs of {len(batch)} shortlinks failed, error: {result}")
+                continue
+            stats.update({
+                short_link: result[short_link.reference_id]
+                for short_link in batch if short_link.reference_id in result
+            })
+        return stats, etags
+
+    previous_etags = cache.get_many([stats_etag_key(short_link.reference_id) for short_link in short_links])
+    for short_link, result in admd.map(
+            lambda short_link: admd.shortlink_stats(
+                short_link.reference_id, previous_etags.get(stats_etag_key(short_link.reference_id))
+            ),
+            short_links
+    ):
+        if isinstance(result, ShortLinkError):
+            logger.error(f"reading logs of shortlink: {short_link.reference_id} failed, error: {result}")
+            continue
+
+        link_stats, etag = result
+        if link_stats is not None:
+            stats[short_link] = link_stats
+        if etag:
+            etags[stats_etag_key(short_link.reference_id)] = etag
+    return stats, etags
+
+
+def local_short_links_stats(short_links, latest_counts, link_clicks):
+    """
+        stats of local shortlinks, their latest counts and clicks counted since then
+
+    :param link_clicks: {short_link_id: (hits, ips)} of clicks.read_clicks
+    :return: {short_link: stats} of links which have new clicks
+    """
+    stats = {}
+    for short_link in short_links:
+        if short_link.id not in link_clicks:
+            continue
+        hit_count, ip_count = latest_counts.get(short_link.id, (0, 0))
+        hits, ips = link_clicks[short_link.id]
+        stats[short_link] = {'hit_count': hit_count + hits, 'ip_count': ip_count + ips}
+    return stats
+
+
 @shared_task
 def log_short_links():
     """
     read shortlink log if It's campaign status is approved or close
     and still need to read the logs
 
+    links are read and written in chunks of SHORT_LINK_LOGS_CHUNK and a log is created only
+    if hit or ip count of link is changed since its latest log. local shortlinks flush their click counters
+
     :return:
     """
-    short_links = ShortLink.objects.filter(
+    short_links = list(ShortLink.objects.filter(
         campaign_post__id__in=valid_campaign_post_ids()
-    )
+    ).only(
+        'id', 'reference_id', 'hit_count', 'ip_count'
+    ).order_by('id'))
 
-    short_links_logs = []
-    for short_link in short_links:
-        try:
-            r = requests.get(f'{settings.ADMD_API_URL}{short_link.reference_id}',
-                             headers={'Authorization': settings.ADMD_API_TOKEN})
-
-            r.raise_for_status()
-            result = r.json()
-        except requests.HTTPError:
-            logger.error(f'requests error: {r.status_code}, body: {r.text}')
-        except Exception as e:
-            logger.error(f'This exception occurred because of {e}')
+    created_count = write_short_links_logs(short_links)
+    logger.info(f"{created_count} logs of {len(short_links)} shortlinks are created")
+
+
+def write_short_links_logs(short_links):
+    """
+        read stats of short_links and log the changed ones, counts of logged links are kept on them
+
+    :param short_links: ShortLinks with their id, reference_id, hit_count and ip_count
+    :return: number of created logs
+    """
+    created_count = 0
+    for i in range(0, len(short_links), SHORT_LINK_LOGS_CHUNK):
+        chunk = short_links[i:i + SHORT_LINK_LOGS_CHUNK]
+        latest_counts = {
+            short_link.id: (short_link.hit_count, short_link.ip_count)
+            for short_link in chunk if short_link.hit_count is not None
+        }
+
+        link_clicks = {}
+        if clicks.is_local_backend():
+            link_clicks = clicks.read_clicks([short_link.id for short_link in chunk])
+            stats, etags = local_short_links_stats(chunk, latest_counts, link_clicks), {}
         else:
-            short_links_logs.append(
-                ShortLinkLog(
-                    short_link=short_link,
-                    hit_count=result['hit_count'],
-                    ip_count=result['ip_count']
-                )
-            )
-            logger.debug(msg=f'Number of clicks for ({short_link.reference_id}) reference_id is {result["hit_count"]}')
+            stats, etags = read_short_links_stats(chunk)
 
-    ShortLinkLog.objects.bulk_create(short_links_logs)
+        changed_links = []
+        for short_link, link_stats in stats.items():
+            if latest_counts.get(short_link.id) == (link_stats['hit_count'], link_stats['ip_count']):
+                continue
+            short_link.hit_count = link_stats['hit_count']
+            short_link.ip_count = link_stats['ip_count']
+            changed_links.append(short_link)
+
+        with transaction.atomic():
+            ShortLinkLog.objects.bulk_create([
+                ShortLinkLog(short_link=short_link, hit_count=short_link.hit_count, ip_count=short_link.ip_count)
+                for short_link in changed_links
+            ])
+            ShortLink.objects.bulk_update(changed_links, ['hit_count', 'ip_count'])
+            # counted clicks are removed only when their logs are written
+            transaction.on_commit(lambda link_clicks=link_clicks: clicks.release_clicks(link_clicks))
+        cache.set_many(etags, STATS_ETAG_TIMEOUT)
+        created_count += len(changed_links)
+    return created_count
 
 
 @shared_task
@@ -388,8 +654,8 @@ def receive_shot(telegram_user_id, file_id, campaign_post_id):
             campaign_post.screen_time = timezone.now()
             update_fields = ['updated_time', 'screen_shot', 'screen_time']
             if campaign_post.views is None:
-                read_campaign_posts_views([campaign_post], log_mode=False, update_views=False)
-                update_fields.append('views')
+                # views are written by the reader, which also adds them to content views counters
+                read_campaign_posts_views([campaign_post], log_mode=False, update_views=True)
 
             campaign_post.save(update_fields=update_fields)
 
@@ -400,19 +666,33 @@ def receive_shot(telegram_user_id, file_id, campaign_post_id):
         agent.send_message(telegram_user_id, texts.SEND_SHOT_ERROR, reply_markup=buttons.start_buttons())
 
 
+def get_full_channel(client, channel):
+    try:
+        return client(GetFullChannelRequest(channel.channel_id))
+    except ValueError:
+        return client(GetFullChannelRequest(channel.tag))
+
+
 @shared_task
 def update_channels(channel_ids):
-    channels = TelegramChannel.objects.filter(id__in=channel_ids, channel_id__isnull=False)
+    """
+        update channels title, tag and members, if no session can call GetFullChannel now
+        the remaining channels are rescheduled for the time governor allows
+    """
+    if forward_to_worker(update_channels, channel_ids):
+        return
 
-    adm_ts = _get_telegram_admin_user()
-    with TelegramClient(StringSession(adm_ts.session), adm_ts.api_id, adm_ts.api_hash, proxy=TELETHON_PROXY) as client:
-        client.session.save_entities = False
-        client.flood_sleep_threshold = 0
-        for channel in channels:
+    channels = list(TelegramChannel.objects.filter(id__in=channel_ids, channel_id__isnull=False).order_by('id'))
+
+    with session_pool(flood_sleep_threshold=0) as pool:
+        for i, channel in enumerate(channels):
             try:
-                channel_info = client(GetFullChannelRequest(channel.channel_id))
-            except ValueError:
-                channel_info = client(GetFullChannelRequest(channel.tag))
+                channel_info = pool.execute(get_full_channel, channel, method=GetFullChannelRequest.__name__)
+            except NoSessionAvailable as e:
+                if e.wait is not None:
+                    logger.warning(f"updating channels rescheduled from: {channel} in {e.wait} seconds")
+                    update_channels.apply_async(args=[[ch.id for ch in channels[i:]]], countdown=int(e.wait) + 1)
+                break
             except Exception as e:
                 logger.error(f"updating channel info: {channel}, got error: {e} type: {type(e)}")
                 break
@@ -423,9 +703,6 @@ def update_channels(channel_ids):
 
             channel.save(update_fields=['updated_time', 'title', 'tag', 'member_no'])
 
-        adm_ts.session = client.session.save()
-        adm_ts.save()
-
 
 def grab_file_id(telegram_message, file_type):
     """
@@ -469,8 +746,7 @@ def render_text_and_inline(campaign_content, campaign_user_id):
         try:
             short_link = get_shortlink(campaign_link, campaign_content.campaign.title, campaign_user_id)
             short_link_ids.append(short_link.id)
-        except Exception as e:
-            logger.error(f"{e}")
+        except ShortLinkError:
             continue
 
         # change links in text
@@ -1,3 +1,228 @@
-from django.test import TestCase
+import asyncio
+from urllib.parse import urlsplit, parse_qs
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from apps.telegram_adv.models import CampaignContent, CampaignLink, CampaignPost, ReceiverChannel, ShortLink
+from apps.telegram_bot import clicks
+from apps.telegram_bot.admd import AdmdClient
+from apps.telegram_bot.fake_admd import start_server
+from apps.telegram_bot.scheduler import poll_interval, within_call_budget
+from apps.telegram_bot.views_reader import (
+    group_posts_by_channel, read_channel_views, read_channel_views_by_ids, VIEWS_BATCH_SIZE
+)
+
+
+def campaign_post(post_id, message_id, mother_channel):
+    return CampaignPost(
+        id=post_id,
+        message_id=message_id,
+        campaign_content=CampaignContent(mother_channel=mother_channel),
+    )
+
+
+class FakeViewsClient:
+    """
+        telethon client which returns message id as views of every message and records requested ids
+    """
+    def __init__(self):
+        self.calls = []
+        self.peers = []
+
+    async def __call__(self, request):
+        self.calls.append(list(request.id))
+        self.peers.append(request.peer)
+        return list(request.id)
+
+
+class PeerlessViewsClient(FakeViewsClient):
+    """
+        telethon client of a session which has not cached the peer of channel ids
+    """
+    async def __call__(self, request):
+        if isinstance(request.peer, int):
+            self.peers.append(request.peer)
+            raise ValueError('Could not find the input entity')
+        return await super().__call__(request)
+
+
+class FakePool:
+    def __init__(self, client):
+        self._client = client
+
+    def acquire(self, method=None):
+        return 'session'
+
+    def take(self, session, method=None):
+        return 0
+
+    async def client(self, session):
+        return self._client
+
+    def report_error(self, session, error):
+        return False
+
+
+class ViewsBatchingTestCase(SimpleTestCase):
+    def test_group_posts_by_channel(self):
+        channel = ReceiverChannel(chat_id=-1001, tag='@channel')
+        posts = [campaign_post(1, 10, channel), campaign_post(2, 10, channel), campaign_post(3, 11, channel)]
+        posts.append(campaign_post(4, None, channel))
+
+        channels = group_posts_by_channel(posts)
+
+        self.assertEqual(list(channels), [-1001])
+        self.assertEqual({message_id: [post.id for post in posts] for message_id, posts in channels[-1001].items()},
+                         {10: [1, 2], 11: [3]})
+
+    def test_read_by_id_batches(self):
+        client = FakeViewsClient()
+        channel_posts = {message_id: [message_id] for message_id in range(1, 251)}
+
+        results = asyncio.new_event_loop().run_until_complete(
+            read_channel_views_by_ids(FakePool(client), -1001, channel_posts, [])
+        )
+
+        self.assertEqual([len(call) for call in client.calls], [VIEWS_BATCH_SIZE, VIEWS_BATCH_SIZE, 50])
+        self.assertEqual(sorted(results), [([message_id], message_id) for message_id in range(1, 251)])
+
+    def test_within_call_budget(self):
+        first_channel = ReceiverChannel(id=1)
+        second_channel = ReceiverChannel(id=2)
+        posts = [campaign_post(i, i, first_channel) for i in range(150)]
+        posts += [campaign_post(1000 + i, i, second_channel) for i in range(10)]
+        for post in posts:
+            post.latest_views = 10
+
+        selected, deferred = within_call_budget(posts, budget=2, batch_size=100)
+
+        self.assertEqual(len(selected), 150)
+        self.assertEqual(deferred, posts[150:])
+
+    def test_posts_of_a_message_share_its_call(self):
+        channel = ReceiverChannel(id=1)
+        posts = [campaign_post(i, 1, channel) for i in range(5)]
+
+        # one views call and one probe call
+        selected, deferred = within_call_budget(posts, budget=2, batch_size=100)
+
+        self.assertEqual((len(selected), deferred), (5, []))
+
+    def test_missing_message_probes_are_charged(self):
+        channel = ReceiverChannel(id=1)
+        posts = [campaign_post(i, i, channel) for i in range(3)]
+        posts[0].latest_views = 10
+
+        # the read batch and the probe of its messages without views
+        selected, deferred = within_call_budget(posts, budget=1, batch_size=100)
+        self.assertEqual((selected, deferred), (posts[:1], posts[1:]))
+
+        selected, deferred = within_call_budget(posts, budget=2, batch_size=100)
+        self.assertEqual((selected, deferred), (posts, []))
+
+
+class ChannelPeerTestCase(SimpleTestCase):
+    def read(self, channel):
+        client = PeerlessViewsClient()
+        channel_posts = {1: [campaign_post(1, 1, channel)], 1000: [campaign_post(2, 1000, channel)]}
+        failures = []
+        results = asyncio.new_event_loop().run_until_complete(
+            read_channel_views(FakePool(client), channel.get_id_or_tag, channel_posts, failures)
+        )
+        return client, results, failures
+
+    def test_missing_peer_is_read_by_tag(self):
+        client, results, failures = self.read(ReceiverChannel(chat_id=-1001, tag='@channel'))
+
+        self.assertEqual(client.peers, [-1001, '@channel'])
+        self.assertEqual(sorted(views for posts, views in results), [1, 1000])
+        self.assertEqual(failures, [])
+
+    def test_missing_peer_is_not_a_channel_failure(self):
+        client, results, failures = self.read(ReceiverChannel(chat_id=-1001, tag=''))
+
+        self.assertEqual((client.peers, results), ([-1001], []))
+        self.assertEqual([(mother_channel, error) for mother_channel, error, posts_list in failures], [(-1001, None)])
+
+
+@override_settings(
+    VIEWS_POLL_MIN_INTERVAL=30,
+    VIEWS_POLL_MAX_INTERVAL=720,
+    VIEWS_POLL_AGE_DOUBLING=12,
+    VIEWS_POLL_GROWTH_STEP=0.03,
+)
+class PollIntervalTestCase(SimpleTestCase):
+    def test_new_post_is_polled_every_cycle(self):
+        interval = poll_interval(timezone.timedelta(hours=1), 1000, None)
+        self.assertEqual(interval, timezone.timedelta(minutes=30))
+
+    def test_growth_step(self):
+        # 3% of 1000 views in 30 views per hour
+        interval = poll_interval(timezone.timedelta(hours=48), 1000, 30)
+        self.assertEqual(interval, timezone.timedelta(hours=1))
+
+    def test_flat_post_is_limited_by_its_age(self):
+        self.assertEqual(poll_interval(timezone.timedelta(hours=12), 1000, 0), timezone.timedelta(hours=1))
+        self.assertEqual(poll_interval(timezone.timedelta(days=30), 1000, 0), timezone.timedelta(hours=12))
+
+    def test_fast_post_is_not_polled_faster_than_min_interval(self):
+        interval = poll_interval(timezone.timedelta(hours=48), 1000, 10000)
+        self.assertEqual(interval, timezone.timedelta(minutes=30))
+
+
+@override_settings(SHORTLINK_UNIQUE_IP_TIMEOUT=60)
+class ClicksTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_target_url(self):
+        campaign_link = CampaignLink(
+            link='https://example.com/page?ref=1#top',
+            extra_data={'utm_source': 'telegram', 'utm_medium': None, 'utm_campaign': 7},
+        )
+        target = clicks.target_url(ShortLink(campaign_link=campaign_link, utm_content='token'))
+
+        scheme, netloc, path, query, fragment = urlsplit(target)
+        self.assertEqual((scheme, netloc, path, fragment), ('https', 'example.com', '/page', 'top'))
+        self.assertEqual(parse_qs(query), {
+            'ref': ['1'], 'utm_source': ['telegram'], 'utm_campaign': ['7'], 'utm_content': ['token']
+        })
+
+    def test_read_and_release_clicks(self):
+        for ip in ('1.1.1.1', '1.1.1.1', '2.2.2.2'):
+            clicks.count_click(1, ip)
+
+        link_clicks = clicks.read_clicks([1, 2])
+        self.assertEqual(link_clicks, {1: (3, 2)})
+
+        # counted between reading and releasing
+        clicks.count_click(1, '3.3.3.3')
+        clicks.release_clicks(link_clicks)
+        self.assertEqual(clicks.read_clicks([1]), {1: (1, 1)})
+
+
+class FakeAdmdTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.server, api_url = start_server(latency=0, jitter=0, click_rate=0)
+        self.settings = override_settings(ADMD_API_URL=api_url, ADMD_STATS_BATCH_URL=f'{api_url}batch')
+        self.settings.enable()
+        self.admd = AdmdClient(circuit_prefix='test_admd_circuit')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_round_trip(self):
+        created = self.admd.create_shortlink({'dest_url': 'https://example.com'})
+        self.assertEqual(created['short_url'], f"http://fake.admd/{created['id']}")
+
+        stats, etag = self.admd.shortlink_stats(created['id'])
+        self.assertEqual((stats['hit_count'], stats['ip_count']), (0, 0))
+        self.assertEqual(self.admd.shortlink_stats(created['id'], etag), (None, etag))
+
+        self.assertEqual(list(self.admd.shortlinks_stats([created['id'], 1000])), [created['id']])
+        self.assertEqual(self.server.admd.requests, 4)
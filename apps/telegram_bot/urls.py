@@ -1,10 +1,11 @@
 from django.urls import path
 from django.conf import settings
 
-from .views import web_hook
+from .views import web_hook, short_link_redirect
 
 webhook_prefix = settings.TELEGRAM_BOT.get('WEBHOOK_PREFIX', '')
 
 urlpatterns = [
+    path("l/<str:code>", short_link_redirect, name='short-link'),
     path(f"{webhook_prefix}<str:token>", web_hook, name='telegram-webhook'),
 ]
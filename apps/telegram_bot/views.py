@@ -6,14 +6,15 @@ from threading import Thread
 
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 
 from telegram import Bot, Update
 from telegram.utils.request import Request
 from telegram.ext import Dispatcher, MessageHandler, CallbackQueryHandler, Filters, CommandHandler
 from telegram.error import InvalidToken, TelegramError
 
-from apps.telegram_bot import telegrambot
+from apps.telegram_bot import telegrambot, clicks
+from apps.utils.url_encoder import EncoderError
 
 
 logger = logging.getLogger(__name__)
@@ -75,3 +76,18 @@ def web_hook(request, token):
         logger.error(f'Bot <{bot.username}>: Unknown error: {e}, body: {request.body}')
 
     return HttpResponse()
+
+
+def short_link_redirect(request, code):
+    if not clicks.is_local_backend():
+        raise Http404('shortlinks are not served locally')
+
+    try:
+        short_link_id, target = clicks.resolve(code)
+    except EncoderError:
+        raise Http404('invalid shortlink')
+    if target is None:
+        raise Http404('shortlink does not exist')
+
+    clicks.count_click(short_link_id, clicks.client_ip(request))
+    return HttpResponseRedirect(target)
@@ -0,0 +1,621 @@
+import math
+import time
+import asyncio
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.core.cache import cache
+from django.utils import timezone
+
+from telethon.errors import ChannelPrivateError, ChannelInvalidError, UsernameInvalidError, UsernameNotOccupiedError
+from telethon.tl.functions.channels import GetMessagesRequest
+from telethon.tl.functions.messages import GetMessagesViewsRequest, GetHistoryRequest
+from telethon.tl.types import InputMessageID, MessageEmpty
+
+from apps.tel_tools.pool import AsyncTelegramSessionPool, WorkerSessionPool
+from apps.telegram_adv.models import (
+    CampaignContent,
+    CampaignContentViews,
+    CampaignPost,
+    CampaignPostLog,
+    CampaignPostPoll,
+    CampaignPostSeries
+)
+
+logger = logging.getLogger(__name__)
+
+# messages.getMessagesViews accepts at most 100 message ids per call
+VIEWS_BATCH_SIZE = 100
+VIEWS_METHOD = GetMessagesViewsRequest.__name__
+HISTORY_METHOD = GetHistoryRequest.__name__
+MESSAGES_METHOD = GetMessagesRequest.__name__
+WRITE_BATCH_SIZE = 500
+# seconds a process holds a total view message to read it and others wait for its reading
+VIEWS_LOCK_TIMEOUT = 30
+VIEWS_LOCK_WAIT = 10
+
+CHANNEL_INVALID_ERRORS = (ChannelInvalidError, UsernameInvalidError, UsernameNotOccupiedError)
+# telethon raises ValueError when the session has no cached peer of a channel id, it is an error of session
+PEER_NOT_FOUND_ERRORS = (ValueError,)
+
+
+def group_posts_by_channel(campaign_posts):
+    """
+        group campaign posts by their mother channel and message id,
+        posts of a total view content share one message so it is read once
+
+    :param campaign_posts:
+    :return: {mother_channel: {message_id: [campaign_post, ...]}}
+    """
+    channels = {}
+    for campaign_post in campaign_posts:
+        mother_channel = campaign_post.campaign_content.mother_channel
+        if mother_channel is None or campaign_post.message_id is None:
+            logger.error(f"read view for post: {campaign_post.id} skipped, no mother channel or message id")
+            continue
+
+        channels.setdefault(
+            mother_channel.get_id_or_tag, {}
+        ).setdefault(
+            campaign_post.message_id, []
+        ).append(
+            campaign_post
+        )
+
+    return channels
+
+
+def read_error(error):
+    """
+        permanent read failure of a channel, None for transient errors which are retried next cycle
+    """
+    if isinstance(error, ChannelPrivateError):
+        return CampaignPost.READ_ERROR_CHANNEL_PRIVATE
+    if isinstance(error, CHANNEL_INVALID_ERRORS):
+        return CampaignPost.READ_ERROR_CHANNEL_INVALID
+    return None
+
+
+async def missing_messages(pool, session, client, mother_channel, message_ids):
+    """
+        deleted messages among messages which are read with zero views, the check takes a governor token of
+        session. if session can not call in TELEGRAM_SESSION_MAX_WAIT none is returned, they are checked next read
+    """
+    wait = pool.take(session, MESSAGES_METHOD)
+    while wait:
+        if wait > settings.TELEGRAM_SESSION_MAX_WAIT:
+            return set()
+        await asyncio.sleep(wait)
+        wait = pool.take(session, MESSAGES_METHOD)
+
+    messages = await client(GetMessagesRequest(
+        channel=mother_channel,
+        id=[InputMessageID(message_id) for message_id in message_ids]
+    ))
+    return {
+        message.id for message in messages.messages
+        if isinstance(message, MessageEmpty)
+    }
+
+
+async def read_channel_views_by_ids(pool, mother_channel, channel_posts, failures, peer=None):
+    """
+        read views of a channel messages in batches of VIEWS_BATCH_SIZE, every batch is read by the
+        session which has the most remaining tokens and is not blocked by a FloodWait.
+
+        * messages.getMessagesViews returns views in the same order of requested ids
+        * short governor waits are awaited, longer ones leave the remaining messages to the next cycle
+        * messages which are read with zero views are checked and deleted ones are added to failures,
+          a failed call adds every remaining message to failures, by None error if it is not permanent
+
+    :param pool: AsyncTelegramSessionPool
+    :param mother_channel: id or tag of channel
+    :param channel_posts: {message_id: [campaign_post, ...]}
+    :param failures: list which (mother_channel, read error or None, [campaign_posts, ...]) are added to
+    :param peer: id or tag which channel is requested by, default is mother_channel
+    :return: list of (campaign_posts, views)
+    :raise: PEER_NOT_FOUND_ERRORS if a session has not the peer of channel
+    """
+    peer = peer or mother_channel
+    results = []
+    pending = dict(channel_posts)
+    session = pool.acquire(VIEWS_METHOD)
+    while pending and session is not None:
+        wait = pool.take(session, VIEWS_METHOD)
+        if wait > settings.TELEGRAM_SESSION_MAX_WAIT:
+            break
+        elif wait:
+            await asyncio.sleep(wait)
+            continue
+
+        batch_ids = sorted(pending)[:VIEWS_BATCH_SIZE]
+        try:
+            client = await pool.client(session)
+            views = await client(GetMessagesViewsRequest(peer=peer, id=batch_ids, increment=False))
+            zero_ids = [message_id for message_id, banner_views in zip(batch_ids, views) if not banner_views]
+            missing_ids = await missing_messages(
+                pool, session, client, peer, zero_ids
+            ) if zero_ids else set()
+        except Exception as e:
+            if isinstance(e, PEER_NOT_FOUND_ERRORS):
+                raise
+            if not pool.report_error(session, e):
+                logger.error(f"read views for channel: {mother_channel} failed, error: {e}")
+                failures.append((mother_channel, read_error(e), list(pending.values())))
+                pending = {}
+                break
+        else:
+            if missing_ids:
+                failures.append((
+                    mother_channel,
+                    CampaignPost.READ_ERROR_MESSAGE_MISSING,
+                    [pending.pop(message_id) for message_id in missing_ids]
+                ))
+            results.extend(
+                (pending.pop(message_id), banner_views)
+                for message_id, banner_views in zip(batch_ids, views)
+                if message_id not in missing_ids
+            )
+
+        session = pool.acquire(VIEWS_METHOD)
+
+    if pending:
+        logger.warning(f"read views for channel: {mother_channel} remained for {len(pending)} messages")
+
+    return results
+
+
+async def scan_channel_messages(pool, mother_channel, min_id, max_id, progress):
+    """
+        stream (message id, views) of channel messages from max_id down to min_id, a page of
+        VIEWS_BATCH_SIZE messages is in memory at a time and every page is read by the session which
+        has the most remaining tokens.
+
+        stops early if no session can read soon, `progress['complete']` is set when the whole range is scanned
+
+    :raise: channel errors which are not handled by pool
+    """
+    offset_id = max_id + 1
+    session = pool.acquire(HISTORY_METHOD)
+    while session is not None:
+        wait = pool.take(session, HISTORY_METHOD)
+        if wait > settings.TELEGRAM_SESSION_MAX_WAIT:
+            return
+        elif wait:
+            await asyncio.sleep(wait)
+            continue
+
+        try:
+            client = await pool.client(session)
+            history = await client(GetHistoryRequest(
+                peer=mother_channel,
+                offset_id=offset_id,
+                offset_date=None,
+                add_offset=0,
+                limit=VIEWS_BATCH_SIZE,
+                max_id=0,
+                min_id=min_id - 1,
+                hash=0
+            ))
+        except Exception as e:
+            if not pool.report_error(session, e):
+                raise
+        else:
+            for message in history.messages:
+                yield message.id, getattr(message, 'views', None)
+
+            if len(history.messages) < VIEWS_BATCH_SIZE or history.messages[-1].id <= min_id:
+                progress['complete'] = True
+                return
+            offset_id = history.messages[-1].id
+
+        session = pool.acquire(HISTORY_METHOD)
+
+
+async def read_channel_views_by_range(pool, mother_channel, channel_posts, failures, peer=None):
+    """
+        read views of a channel messages by one sweep over their id range, messages are matched to
+        posts as they arrive. tracked messages which are service messages or are not in a complete sweep
+        are added to failures as missing, a failed sweep adds the remaining messages by their read error
+
+    :param pool: AsyncTelegramSessionPool
+    :param mother_channel: id or tag of channel
+    :param channel_posts: {message_id: [campaign_post, ...]}
+    :param failures: list which (mother_channel, read error or None, [campaign_posts, ...]) are added to
+    :param peer: id or tag which channel is requested by, default is mother_channel
+    :return: list of (campaign_posts, views)
+    :raise: PEER_NOT_FOUND_ERRORS if a session has not the peer of channel
+    """
+    results = []
+    pending = dict(channel_posts)
+    progress = {}
+    # tracked ids of service messages, they have no views
+    service_posts = []
+    try:
+        async for message_id, views in scan_channel_messages(
+                pool, peer or mother_channel, min(pending), max(pending), progress
+        ):
+            campaign_posts = pending.pop(message_id, None)
+            if campaign_posts is None:
+                continue
+            if views is None:
+                service_posts.append(campaign_posts)
+            else:
+                results.append((campaign_posts, views))
+    except Exception as e:
+        if isinstance(e, PEER_NOT_FOUND_ERRORS):
+            raise
+        logger.error(f"scan views for channel: {mother_channel} failed, error: {e}")
+        failures.append((mother_channel, read_error(e), list(pending.values())))
+        pending = {}
+
+    if service_posts:
+        failures.append((mother_channel, CampaignPost.READ_ERROR_MESSAGE_MISSING, service_posts))
+
+    if progress.get('complete') and pending:
+        failures.append((mother_channel, CampaignPost.READ_ERROR_MESSAGE_MISSING, list(pending.values())))
+        pending = {}
+
+    if pending:
+        logger.warning(f"scan views for channel: {mother_channel} remained for {len(pending)} messages")
+
+    return results
+
+
+def range_scan_is_cheaper(channel_posts):
+    """
+        a channel is swept by its id range when it has at least VIEWS_RANGE_SCAN_MIN_POSTS tracked messages
+        and the sweep needs no more calls than id batches. both read at most VIEWS_BATCH_SIZE messages a call,
+        id batches also check their zero view messages by one more call, which is expected for batches
+        which have a message without views yet
+
+    :param channel_posts: {message_id: [campaign_post, ...]}
+    """
+    if len(channel_posts) < settings.VIEWS_RANGE_SCAN_MIN_POSTS:
+        return False
+
+    message_ids = sorted(channel_posts)
+    batches = [message_ids[i:i + VIEWS_BATCH_SIZE] for i in range(0, len(message_ids), VIEWS_BATCH_SIZE)]
+    check_calls = sum(
+        1 for batch in batches
+        if any(not channel_posts[message_id][0].latest_views for message_id in batch)
+    )
+    range_calls = math.ceil((message_ids[-1] - message_ids[0] + 1) / VIEWS_BATCH_SIZE)
+    return range_calls <= len(batches) + check_calls
+
+
+def channel_tag(channel_posts):
+    """
+        tag of mother channel of channel posts, None if it has not a tag
+    """
+    campaign_posts = next(iter(channel_posts.values()))
+    return campaign_posts[0].campaign_content.mother_channel.tag or None
+
+
+async def read_channel_views(pool, mother_channel, channel_posts, failures):
+    """
+        read views of a channel messages by id batches or by a range sweep, whichever needs fewer calls.
+        a session which has not the peer of channel id reads it again by the channel tag, channels without
+        a tag fail by None error since the error belongs to the session not the channel
+    """
+    read = read_channel_views_by_range if range_scan_is_cheaper(channel_posts) else read_channel_views_by_ids
+    try:
+        return await read(pool, mother_channel, channel_posts, failures)
+    except PEER_NOT_FOUND_ERRORS as e:
+        tag = channel_tag(channel_posts)
+        logger.warning(f"peer of channel: {mother_channel} is not found, tag: {tag}, error: {e}")
+        if tag is None or tag == mother_channel:
+            failures.append((mother_channel, None, list(channel_posts.values())))
+            return []
+
+    try:
+        return await read(pool, mother_channel, channel_posts, failures, peer=tag)
+    except PEER_NOT_FOUND_ERRORS as e:
+        logger.warning(f"peer of channel: {mother_channel} is not found by tag: {tag} either, error: {e}")
+        failures.append((mother_channel, None, list(channel_posts.values())))
+        return []
+
+
+async def read_views(pool, channels, concurrency, failures):
+    """
+        read mother channels concurrently, at most `concurrency` channels at the same time
+
+    :param pool: AsyncTelegramSessionPool
+    :param channels: grouped posts by group_posts_by_channel
+    :param concurrency:
+    :param failures: list of read failures
+    :return: list of (campaign_posts, views)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read_channel(mother_channel, channel_posts):
+        async with semaphore:
+            return await read_channel_views(pool, mother_channel, channel_posts, failures)
+
+    channels_results = await asyncio.gather(*[
+        read_channel(mother_channel, channel_posts)
+        for mother_channel, channel_posts in channels.items()
+    ])
+    return [result for channel_results in channels_results for result in channel_results]
+
+
+def read_channels_views(channels, failures, **client_options):
+    """
+        read views of grouped posts in a new event loop, poll cycle takes as long as the slowest
+        mother channel instead of sum of all posts.
+
+        * the loop is not set as the thread event loop, sync telethon clients of the worker are not affected
+        * inside the telethon worker its loop and connected clients are used
+
+    :param channels: grouped posts by group_posts_by_channel
+    :param failures: list of read failures
+    :param client_options: TelegramClient attributes
+    :return: list of (campaign_posts, views)
+    """
+    channels = {mother_channel: channel_posts for mother_channel, channel_posts in channels.items() if channel_posts}
+    if not channels:
+        return []
+
+    worker_pool = WorkerSessionPool.current
+    if worker_pool is not None:
+        return worker_pool.loop.run_until_complete(
+            read_views(worker_pool, channels, settings.VIEWS_READER_CONCURRENCY, failures)
+        )
+
+    pool = AsyncTelegramSessionPool(**client_options)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(read_views(pool, channels, settings.VIEWS_READER_CONCURRENCY, failures))
+    finally:
+        loop.run_until_complete(pool.disconnect())
+        loop.close()
+        pool.save_sessions()
+
+
+def views_cache_key(mother_channel, message_id):
+    return f'message_views_{mother_channel}_{message_id}'
+
+
+def pop_cached_views(channels):
+    """
+        take total view messages out of channels if they are read in last VIEWS_CACHE_TIMEOUT seconds or
+        another process is reading them right now, the other total view messages are locked for this process
+
+    :param channels: grouped posts by group_posts_by_channel
+    :return: (results of cached messages, {cache key: (mother_channel, message_id, campaign_posts)} of
+              messages which are being read by others, cache keys locked by this process)
+    """
+    shared_messages = {
+        views_cache_key(mother_channel, message_id): (mother_channel, message_id)
+        for mother_channel, channel_posts in channels.items()
+        for message_id, campaign_posts in channel_posts.items()
+        if campaign_posts[0].campaign_content.view_type == CampaignContent.TYPE_VIEW_TOTAL
+    }
+
+    results = []
+    for key, banner_views in cache.get_many(shared_messages).items():
+        mother_channel, message_id = shared_messages.pop(key)
+        results.append((channels[mother_channel].pop(message_id), banner_views))
+
+    reading = {}
+    locked_keys = []
+    for key, (mother_channel, message_id) in shared_messages.items():
+        if cache.add(f'{key}_lock', 1, VIEWS_LOCK_TIMEOUT):
+            locked_keys.append(key)
+        else:
+            reading[key] = (mother_channel, message_id, channels[mother_channel].pop(message_id))
+
+    return results, reading, locked_keys
+
+
+def cache_views(results, keys):
+    """
+        store views of locked total view messages for other readers
+    """
+    keys = set(keys)
+    readings = {}
+    for campaign_posts, banner_views in results:
+        campaign_post = campaign_posts[0]
+        key = views_cache_key(campaign_post.campaign_content.mother_channel.get_id_or_tag, campaign_post.message_id)
+        if key in keys:
+            readings[key] = banner_views
+    cache.set_many(readings, settings.VIEWS_CACHE_TIMEOUT)
+
+
+def wait_cached_views(reading):
+    """
+        wait up to VIEWS_LOCK_WAIT seconds for messages which other processes are reading
+
+    :param reading: {cache key: (mother_channel, message_id, campaign_posts)}
+    :return: (results, channels of messages which are not read by others in time)
+    """
+    results = []
+    deadline = time.time() + VIEWS_LOCK_WAIT
+    while reading and time.time() < deadline:
+        time.sleep(0.5)
+        for key, banner_views in cache.get_many(reading).items():
+            results.append((reading.pop(key)[2], banner_views))
+
+    channels = {}
+    for mother_channel, message_id, campaign_posts in reading.values():
+        channels.setdefault(mother_channel, {})[message_id] = campaign_posts
+    return results, channels
+
+
+def read_error_cache_key(mother_channel):
+    return f'views_read_error_{mother_channel}'
+
+
+def pop_failed_channels(channels):
+    """
+        take channels which a permanent read error is cached for them out of channels
+
+    :param channels: grouped posts by group_posts_by_channel
+    :return: list of read failures
+    """
+    keys = {read_error_cache_key(mother_channel): mother_channel for mother_channel in channels}
+    return [
+        (keys[key], error, list(channels.pop(keys[key]).values()))
+        for key, error in cache.get_many(keys).items()
+    ]
+
+
+def forget_read_errors(mother_channels):
+    """
+        delete cached errors and strikes of channels so their posts are read again
+
+    :param mother_channels: ids or tags of channels
+    """
+    keys = [read_error_cache_key(mother_channel) for mother_channel in mother_channels]
+    cache.delete_many(keys + [f'{key}_strike' for key in keys])
+
+
+def record_read_failures(failures, cached=False):
+    """
+        flag posts of permanent read failures, they are not read and polled anymore.
+        channel errors are cached for VIEWS_READ_ERROR_CACHE seconds so other posts of the channel skip it.
+        a channel is flagged only when it fails again in that time, its peer may be just stale or only the
+        session which read it may be banned from a private channel
+
+    :param failures: list of (mother_channel, read error, [campaign_posts, ...]), None errors are not permanent
+    :param cached: failures are taken from cached channel errors
+    """
+    flagged = {}
+    for mother_channel, error, posts_list in failures:
+        if error is None:
+            continue
+        if not cached and error != CampaignPost.READ_ERROR_MESSAGE_MISSING:
+            key = read_error_cache_key(mother_channel)
+            if cache.add(f'{key}_strike', 1, settings.VIEWS_READ_ERROR_CACHE):
+                continue
+            cache.set(key, error, settings.VIEWS_READ_ERROR_CACHE)
+
+        flagged.setdefault(error, []).extend(
+            campaign_post.id for campaign_posts in posts_list for campaign_post in campaign_posts
+        )
+
+    now = timezone.now()
+    for error, post_ids in flagged.items():
+        logger.warning(f"read views of {len(post_ids)} posts failed permanently, error: {error}, posts: {post_ids}")
+        with transaction.atomic():
+            CampaignPost.objects.filter(id__in=post_ids).update(read_error=error, read_error_time=now)
+            CampaignPostPoll.objects.filter(campaign_post_id__in=post_ids).delete()
+
+
+def read_posts_views(campaign_posts, failed_posts=None, **client_options):
+    """
+        read views of campaign posts, a total view message which many posts point at is read once in
+        VIEWS_CACHE_TIMEOUT seconds by all processes and entry points.
+        posts with a read error are skipped and new permanent failures are recorded on posts.
+        posts which are neither read nor failed are deferred by governor or flood waits
+
+    :param campaign_posts:
+    :param failed_posts: list which posts that their reading was tried and failed are added to
+    :param client_options: TelegramClient attributes
+    :return: list of (campaign_posts, views)
+    """
+    channels = group_posts_by_channel(campaign_post for campaign_post in campaign_posts if not campaign_post.read_error)
+    record_read_failures(pop_failed_channels(channels), cached=True)
+    failures = []
+    results, reading, locked_keys = pop_cached_views(channels)
+    try:
+        read_results = read_channels_views(channels, failures, **client_options)
+        cache_views(read_results, locked_keys)
+    finally:
+        cache.delete_many([f'{key}_lock' for key in locked_keys])
+    results.extend(read_results)
+
+    if reading:
+        cached_results, channels = wait_cached_views(reading)
+        results.extend(cached_results)
+        results.extend(read_channels_views(channels, failures, **client_options))
+
+    record_read_failures(failures)
+    if failed_posts is not None:
+        failed_posts.extend(
+            campaign_post
+            for mother_channel, error, posts_list in failures
+            for campaign_posts in posts_list
+            for campaign_post in campaign_posts
+        )
+    return results
+
+
+def log_is_due(campaign_post, views, now):
+    """
+        change only logging, a reading is logged if views has changed since the latest log of post
+        or VIEWS_LOG_HEARTBEAT minutes are passed from it, readers carry the latest log forward.
+        zero heartbeat logs every reading
+    """
+    heartbeat = settings.VIEWS_LOG_HEARTBEAT
+    return (
+        not heartbeat
+        or campaign_post.latest_views_at is None
+        or campaign_post.latest_views != views
+        or now - campaign_post.latest_views_at >= timezone.timedelta(minutes=heartbeat)
+    )
+
+
+def counted_views(views, latest_views):
+    """
+        views of a post in campaign counters, its final views if it is set else latest logged views
+    """
+    if views is not None:
+        return views
+    return latest_views or 0
+
+
+def save_posts_views(results, log_mode=True, update_views=False):
+    """
+        write views readings in bulk
+
+    :param results: list of (campaign_posts, views)
+    :param log_mode: create CampaignPostLog for posts which their log is due and update their latest views
+    :param update_views: update CampaignPost views field
+    """
+    telegram_log = []
+    updated_posts = []
+    counter_readings = []
+    update_fields = []
+    if update_views:
+        update_fields.extend(['updated_time', 'views'])
+    if log_mode:
+        update_fields.extend(['latest_views', 'latest_views_at'])
+
+    now = timezone.now()
+    for campaign_posts, banner_views in results:
+        for campaign_post in campaign_posts:
+            logged = log_mode and log_is_due(campaign_post, banner_views, now)
+            old_views = counted_views(campaign_post.views, campaign_post.latest_views)
+            stored_views = banner_views if update_views else campaign_post.views
+            campaign_post.views = banner_views
+            campaign_post.updated_time = now
+            if update_views or logged:
+                updated_posts.append(campaign_post)
+
+            if logged:
+                campaign_post.latest_views = banner_views
+                campaign_post.latest_views_at = now
+                telegram_log.append(
+                    CampaignPostLog(
+                        campaign_post=campaign_post,
+                        banner_views=banner_views,
+                    )
+                )
+            if campaign_post.is_enable and (update_views or logged):
+                counter_readings.append(
+                    (campaign_post.campaign_content, old_views, counted_views(stored_views, campaign_post.latest_views))
+                )
+            logger.info(
+                f"read view for post: {campaign_post.id} and campaign: {campaign_post.campaign_content.campaign_id}")
+
+    with transaction.atomic():
+        if updated_posts:
+            CampaignPost.objects.bulk_update(updated_posts, update_fields, batch_size=WRITE_BATCH_SIZE)
+        if telegram_log:
+            CampaignPostLog.objects.bulk_create(telegram_log, batch_size=WRITE_BATCH_SIZE)
+            CampaignPostSeries.objects.add_readings(
+                (log.campaign_post.id, now, log.banner_views) for log in telegram_log
+            )
+        CampaignContentViews.objects.add_readings(counter_readings)
@@ -0,0 +1,13 @@
+from django.conf import settings
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_process_local_cache(alias='default'):
+    """
+        cache is not shared by processes, e.g. the default LocMemCache
+    """
+    return settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES
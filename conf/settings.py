@@ -147,6 +147,30 @@ EXPIRE_PUSH_SCHEDULE = ast.literal_eval(config('EXPIRE_PUSH_SCHEDULE'))
 SEND_PUSH_SHOT_SCHEDULE = ast.literal_eval(config('SEND_PUSH_SHOT_SCHEDULE'))
 REMOVE_TEST_CAMPAIGNS_SCHEDULE = ast.literal_eval(config('REMOVE_TEST_CAMPAIGNS_SCHEDULE'))
 CLOSE_CAMPAIGN_BY_MAX_VIEW_SCHEDULE = ast.literal_eval(config('CLOSE_CAMPAIGN_BY_MAX_VIEW_SCHEDULE'))
+ROLLUP_POST_LOGS_SCHEDULE = ast.literal_eval(config('ROLLUP_POST_LOGS_SCHEDULE', default="{'minute': 0, 'hour': 4}"))
+FORECAST_CAMPAIGNS_FILL_SCHEDULE = ast.literal_eval(
+    config('FORECAST_CAMPAIGNS_FILL_SCHEDULE', default="{'minute': '*/5'}")
+)
+RECONCILE_CONTENTS_VIEWS_SCHEDULE = ast.literal_eval(
+    config('RECONCILE_CONTENTS_VIEWS_SCHEDULE', default="{'minute': '*/30'}")
+)
+FILL_SHORTLINK_POOLS_SCHEDULE = ast.literal_eval(
+    config('FILL_SHORTLINK_POOLS_SCHEDULE', default="{'minute': '*/5'}")
+)
+
+# days which CampaignPostLog rows are kept raw, then as hourly rollups, then as daily rollups (0 keeps forever)
+POST_LOGS_RAW_DAYS = config('POST_LOGS_RAW_DAYS', default=14, cast=int)
+POST_LOGS_HOURLY_DAYS = config('POST_LOGS_HOURLY_DAYS', default=90, cast=int)
+POST_LOGS_DAILY_DAYS = config('POST_LOGS_DAILY_DAYS', default=0, cast=int)
+# days after their campaign end which CampaignPostSeries rows of posts are kept for charts, their views stay in
+# CampaignPostLog rollups and `build_posts_series` packs them again (0 keeps forever)
+POST_SERIES_DAYS = config('POST_SERIES_DAYS', default=90, cast=int)
+
+# monthly partitioned CampaignPostLog and ShortLinkLog tables on postgres, see `partition_logs` command
+LOGS_PARTITIONED = config('LOGS_PARTITIONED', default=False, cast=bool)
+LOGS_PARTITIONS_AHEAD = config('LOGS_PARTITIONS_AHEAD', default=2, cast=int)
+# months which ShortLinkLog partitions are kept, 0 keeps forever
+SHORT_LINK_LOGS_MONTHS = config('SHORT_LINK_LOGS_MONTHS', default=0, cast=int)
 
 # push to get shot for campaign
 END_SHOT_PUSH_TIME_HOUR = config('END_SHOT_PUSH_TIME_HOUR', cast=int, default=24)
@@ -177,12 +201,74 @@ celery_app.conf.beat_schedule = {
     'remove_test_campaigns': {
         'task': 'apps.telegram_adv.tasks.remove_test_campaigns_all_data',
         'schedule': crontab(**REMOVE_TEST_CAMPAIGNS_SCHEDULE),
+    },
+    'rollup_post_logs': {
+        'task': 'apps.telegram_adv.tasks.rollup_campaign_post_logs',
+        'schedule': crontab(**ROLLUP_POST_LOGS_SCHEDULE),
+    },
+    'forecast_campaigns_fill': {
+        'task': 'apps.telegram_adv.tasks.forecast_campaigns_fill',
+        'schedule': crontab(**FORECAST_CAMPAIGNS_FILL_SCHEDULE),
+    },
+    'reconcile_contents_views': {
+        'task': 'apps.telegram_adv.tasks.reconcile_contents_views',
+        'schedule': crontab(**RECONCILE_CONTENTS_VIEWS_SCHEDULE),
+    },
+    'fill_shortlink_pools': {
+        'task': 'apps.telegram_bot.tasks.fill_shortlink_pools',
+        'schedule': crontab(**FILL_SHORTLINK_POOLS_SCHEDULE),
     }
 }
 
 PROXY4TELEGRAM_HOST = config('PROXY4TELEGRAM_HOST', default='')
 PROXY4TELEGRAM_PORT = config('PROXY4TELEGRAM_PORT', default=0, cast=int)
 
+# MTProto rate governor, token bucket of each TelegramSession: refill rate (calls per second) and size
+TELEGRAM_SESSION_CALL_RATE = config('TELEGRAM_SESSION_CALL_RATE', default=0.5, cast=float)
+TELEGRAM_SESSION_CALL_BURST = config('TELEGRAM_SESSION_CALL_BURST', default=20, cast=int)
+# max seconds a task waits for a token, longer waits reschedule the task
+TELEGRAM_SESSION_MAX_WAIT = config('TELEGRAM_SESSION_MAX_WAIT', default=5, cast=int)
+# seconds to put a session aside after auth errors (revoked or unregistered auth key)
+TELEGRAM_SESSION_AUTH_QUARANTINE = config('TELEGRAM_SESSION_AUTH_QUARANTINE', default=6 * 3600, cast=int)
+# forward telethon tasks to the long-lived worker (run_telethon_worker command) through the broker
+TELETHON_WORKER_ENABLED = config('TELETHON_WORKER_ENABLED', default=False, cast=bool)
+TELETHON_WORKER_QUEUE = config('TELETHON_WORKER_QUEUE', default='telethon_jobs')
+# mother channels read at the same time by the asyncio views reader
+VIEWS_READER_CONCURRENCY = config('VIEWS_READER_CONCURRENCY', default=8, cast=int)
+# failed readings of a post of finished campaign before it is settled without views
+VIEWS_SETTLE_RETRIES = config('VIEWS_SETTLE_RETRIES', default=5, cast=int)
+# seconds a total view message reading is shared by every task reading it
+VIEWS_CACHE_TIMEOUT = config('VIEWS_CACHE_TIMEOUT', default=60, cast=int)
+# max view forecast: hours of views history fitted, points of its time grid and minutes before the forecast
+# fill time which campaign posts are polled every VIEWS_POLL_MIN_INTERVAL and campaign gets no new pushes
+VIEWS_FORECAST_WINDOW = config('VIEWS_FORECAST_WINDOW', default=3, cast=int)
+VIEWS_FORECAST_POINTS = config('VIEWS_FORECAST_POINTS', default=13, cast=int)
+VIEWS_FORECAST_POLL_HORIZON = config('VIEWS_FORECAST_POLL_HORIZON', default=60, cast=int)
+VIEWS_FORECAST_PUSH_HORIZON = config('VIEWS_FORECAST_PUSH_HORIZON', default=120, cast=int)
+# mother channels with at least VIEWS_RANGE_SCAN_MIN_POSTS tracked messages are read by one history sweep
+# instead of id batches when the sweep needs fewer calls
+VIEWS_RANGE_SCAN_MIN_POSTS = config('VIEWS_RANGE_SCAN_MIN_POSTS', default=200, cast=int)
+# seconds a permanent read error of a mother channel is cached, posts of that channel are flagged without reading
+VIEWS_READ_ERROR_CACHE = config('VIEWS_READ_ERROR_CACHE', default=3600, cast=int)
+# minutes which unchanged post views are logged again, 0 logs every reading
+VIEWS_LOG_HEARTBEAT = config('VIEWS_LOG_HEARTBEAT', default=60, cast=int)
+
+# adaptive views polling, intervals are in minutes
+VIEWS_POLL_MIN_INTERVAL = config('VIEWS_POLL_MIN_INTERVAL', default=30, cast=int)
+VIEWS_POLL_MAX_INTERVAL = config('VIEWS_POLL_MAX_INTERVAL', default=12 * 60, cast=int)
+# hours of post age which doubles its longest poll interval
+VIEWS_POLL_AGE_DOUBLING = config('VIEWS_POLL_AGE_DOUBLING', default=12, cast=float)
+# poll again when views are expected to grow this fraction
+VIEWS_POLL_GROWTH_STEP = config('VIEWS_POLL_GROWTH_STEP', default=0.03, cast=float)
+# hours of logs to calculate views velocity
+VIEWS_VELOCITY_WINDOW = config('VIEWS_VELOCITY_WINDOW', default=3, cast=int)
+# poll queue workers of each polling cycle, posts claimed by each worker and seconds of their lease
+VIEWS_POLL_WORKERS = config('VIEWS_POLL_WORKERS', default=4, cast=int)
+VIEWS_POLL_CLAIM_SIZE = config('VIEWS_POLL_CLAIM_SIZE', default=1000, cast=int)
+VIEWS_POLL_LEASE = config('VIEWS_POLL_LEASE', default=600, cast=int)
+# MTProto calls of each polling cycle: views batches, missing message probes and range sweeps, shared by its workers
+VIEWS_POLL_CALL_BUDGET = config('VIEWS_POLL_CALL_BUDGET', default=300, cast=int)
+
 # Telegram Bot Configs
 TELEGRAM_BOT = {
     'TOKEN': config('TELEGRAM_BOT_TOKEN'),
@@ -340,8 +426,36 @@ BOT_VIEW_CHANNEL_ID = config('BOT_VIEW_CHANNEL_ID', cast=int)
 BASE_URL = config('BASE_URL')
 BASE_REPORT_URL = config('BASE_REPORT_URL')
 
+# "admd" creates shortlinks on ADMD, "local" serves them by `short-link` view and counts their clicks in cache
+SHORTLINK_BACKEND = config('SHORTLINK_BACKEND', default='admd')
+SHORTLINK_BASE_URL = config('SHORTLINK_BASE_URL', default=f"{BASE_URL.rstrip('/')}/l/")
+# seconds a click of an ip is not counted again as a unique ip of local shortlink
+SHORTLINK_UNIQUE_IP_TIMEOUT = config('SHORTLINK_UNIQUE_IP_TIMEOUT', default=30 * 86400, cast=int)
+# proxies in front of the site which append the client address to X-Forwarded-For, 0 uses REMOTE_ADDR
+SHORTLINK_TRUSTED_PROXIES = config('SHORTLINK_TRUSTED_PROXIES', default=0, cast=int)
+
 ADMD_API_URL = config('ADMD_API_URL')
 ADMD_API_TOKEN = config('ADMD_API_TOKEN')
+# seconds to connect and to read a response of ADMD api
+ADMD_CONNECT_TIMEOUT = config('ADMD_CONNECT_TIMEOUT', default=3.05, cast=float)
+ADMD_TIMEOUT = config('ADMD_TIMEOUT', default=10, cast=float)
+# retries of failed calls, waits are a random part of ADMD_BACKOFF * 2 ** retry up to ADMD_BACKOFF_MAX seconds
+ADMD_RETRIES = config('ADMD_RETRIES', default=3, cast=int)
+ADMD_BACKOFF = config('ADMD_BACKOFF', default=0.5, cast=float)
+ADMD_BACKOFF_MAX = config('ADMD_BACKOFF_MAX', default=8, cast=float)
+# concurrent calls and pooled connections of a process
+ADMD_WORKERS = config('ADMD_WORKERS', default=8, cast=int)
+# failed calls in ADMD_CIRCUIT_RESET seconds which stop calling ADMD for ADMD_CIRCUIT_RESET seconds
+ADMD_CIRCUIT_FAILURES = config('ADMD_CIRCUIT_FAILURES', default=10, cast=int)
+ADMD_CIRCUIT_RESET = config('ADMD_CIRCUIT_RESET', default=60, cast=int)
+# ADMD batch stats url and shortlinks of each call, shortlinks stats are read one by one if it is not set
+ADMD_STATS_BATCH_URL = config('ADMD_STATS_BATCH_URL', default='')
+ADMD_STATS_BATCH_SIZE = config('ADMD_STATS_BATCH_SIZE', default=100, cast=int)
+# pooled shortlinks of each campaign link, the pool is filled up to its claims in the last SHORTLINK_POOL_WINDOW
+# minutes, at least SHORTLINK_POOL_MIN and at most SHORTLINK_POOL_SIZE links. 0 size disables pooling
+SHORTLINK_POOL_SIZE = config('SHORTLINK_POOL_SIZE', default=100, cast=int)
+SHORTLINK_POOL_MIN = config('SHORTLINK_POOL_MIN', default=5, cast=int)
+SHORTLINK_POOL_WINDOW = config('SHORTLINK_POOL_WINDOW', default=15, cast=int)
 
 TEST_CAMPAIGN_USER = config('TEST_CAMPAIGN_USER', cast=int)
 